@@ -0,0 +1,213 @@
+'''Saving a session of verbal decision analysis (an :class:`artiruno.Engine`) to a file, and loading it again without redoing any inference.
+
+A checkpoint file begins with the bytes ``ARTIRUNO``, followed by the format version as a little-endian 32-bit unsigned integer. The rest is a series of sections, each a little-endian 64-bit unsigned length followed by that many bytes:
+
+1. A JSON object with the criteria and the rest of the small state.
+2. For each element of the preferences, in order of ID, the index of its value on each criterion, as 32-bit unsigned integers.
+3. The parent of each element in the union-find structure of the preferences, likewise.
+4. The candidates left for the current alternative in the first stage, as element IDs, likewise.
+5. The pairs of elements to try in the current stage, as pairs of element IDs, likewise.
+6. The pairs of elements to carry forward to the next stage, likewise.
+7–10. Tables of bitsets (see below): the elements greater than each element, those less than each element, the members of each class that has more than one, and lastly the single bitsets ``_merged``, ``_touched``, and ``_later``.
+
+A table of ``n`` bitsets is ``n`` and then ``n + 1`` offsets, all as little-endian 64-bit unsigned integers, followed by the little-endian bytes of each bitset. The offsets are relative to the end of the offsets, and bitset ``i`` runs from offset ``i`` to offset ``i + 1``. Since the file is read with :mod:`mmap`, each bitset is read on its own, without first copying the whole file into memory.
+
+Criterion levels have to be representable in JSON.'''
+
+import sys, os, json, mmap, traceback
+from array import array
+from artiruno.preorder import Relation, DominancePreorderedSet
+from artiruno.vda import Engine, _ItemSpace
+
+MAGIC = b'ARTIRUNO'
+VERSION = 6
+
+def save(engine, path):
+    'Save ``engine`` to the file ``path``, replacing it if it exists. The file is written under a temporary name first, so an interrupted save leaves the old file intact.'
+
+    prefs = engine.prefs
+    ids = prefs._ids.__getitem__
+    def id_or_none(x):
+        return None if x is None else ids(x)
+
+    members = sorted(prefs._members)
+    header = dict(
+        criteria = engine.criteria,
+        implicit = prefs.implicit,
+        alts = (None
+            if isinstance(engine.alts, _ItemSpace)
+            else list(map(ids, engine.alts))),
+        find_best = engine.find_best,
+        n_better = engine.find_best and
+            [engine._n_better[x] for x in engine.alts],
+        max_dev = engine.max_dev,
+        strategy = engine.strategy,
+        group = engine._group,
+        sizes = engine._sizes,
+        allowed_pairs = engine._allowed_pairs,
+        a = id_or_none(engine._a),
+        a_ix = engine._a_ix,
+        b_ix = engine._b_ix,
+        first_stage = engine._pairs is None,
+        p_ix = engine._p_ix,
+        pair = engine._pair and list(map(ids, engine._pair)),
+        stack = [[rel.value, *rest] for rel, *rest in engine._stack],
+        question = engine.question and list(map(ids, engine.question)),
+        step = engine._step,
+        done = engine.done,
+        n_answers = engine.n_answers,
+        members = members)
+
+    sections = [
+        json.dumps(header).encode('UTF-8'),
+        _u32s(v for levels in prefs._levels for v in levels),
+        _u32s(prefs._parent),
+        _u32s(engine._bs),
+        _u32s(engine._pairs or ()),
+        _u32s(engine._open),
+        _table(prefs._up),
+        _table(prefs._down),
+        _table(prefs._members[r] for r in members),
+        _table((prefs._merged, prefs._touched, engine._later))]
+
+    temp = path + '.tmp'
+    with open(temp, 'wb') as o:
+        o.write(MAGIC)
+        o.write(VERSION.to_bytes(4, 'little'))
+        for section in sections:
+            o.write(len(section).to_bytes(8, 'little'))
+            o.write(section)
+    os.replace(temp, path)
+
+def load(path, allowed_pairs_callback = lambda x: None, store = None,
+        undo = 0):
+    'Return the :class:`artiruno.Engine` saved to the file ``path`` by :func:`save`. Raise :class:`ValueError` if the file is not a checkpoint in a version of the format that we can read.'
+
+    with open(path, 'rb') as o, mmap.mmap(
+            o.fileno(), 0, access = mmap.ACCESS_READ) as m:
+        view = memoryview(m)
+        try:
+            return _load(view, allowed_pairs_callback, store, undo)
+        finally:
+            view.release()
+
+def _load(view, allowed_pairs_callback, store, undo):
+    if bytes(view[:len(MAGIC)]) != MAGIC:
+        raise ValueError('Not an Artiruno checkpoint')
+    pos = len(MAGIC)
+    if (version := int.from_bytes(view[pos : pos + 4], 'little')) != VERSION:
+        raise ValueError(f'Unsupported checkpoint version: {version}')
+    pos += 4
+    bounds = []
+    while pos < len(view):
+        n = int.from_bytes(view[pos : pos + 8], 'little')
+        if pos + 8 + n > len(view):
+            raise ValueError('Truncated checkpoint')
+        bounds.append((pos + 8, pos + 8 + n))
+        pos += 8 + n
+    if len(bounds) != 10:
+        raise ValueError('Truncated checkpoint')
+    sections = [view[i:j] for i, j in bounds]
+    try:
+        return _engine(*sections, allowed_pairs_callback, store, undo)
+    except BaseException as e:
+        # The traceback would keep slices of the file alive, and
+        # then the mmap couldn't be closed.
+        traceback.clear_frames(e.__traceback__)
+        raise
+    finally:
+        for section in sections:
+            section.release()
+
+def _engine(header, levels, parent, bs, pairs, open_pairs, up, down,
+        members, misc, allowed_pairs_callback, store, undo):
+    header = json.loads(bytes(header))
+
+    criteria = tuple(map(tuple, header['criteria']))
+    prefs = DominancePreorderedSet(criteria, implicit = header['implicit'])
+    levels = _from_u32s(levels)
+    c = len(criteria)
+    prefs.update(
+        tuple(crit[v] for crit, v in zip(criteria, levels[i : i + c]))
+        for i in range(0, len(levels), c))
+    prefs._parent = list(_from_u32s(parent))
+    prefs._up = _from_table(up)
+    prefs._down = _from_table(down)
+    prefs._members = dict(zip(header['members'], _from_table(members)))
+    prefs._merged, prefs._touched, later = _from_table(misc)
+
+    item = prefs._items.__getitem__
+    def item_or_none(i):
+        return None if i is None else item(i)
+
+    engine = object.__new__(Engine)
+    engine.criteria = criteria
+    engine.prefs = prefs
+    engine.alts = (_ItemSpace(criteria)
+        if header['alts'] is None
+        else tuple(map(item, header['alts'])))
+    engine.find_best = header['find_best']
+    if engine.find_best:
+        engine._n_better = dict(zip(engine.alts, header['n_better']))
+    engine.allowed_pairs_callback = allowed_pairs_callback
+    engine.store = store
+    engine.max_dev = header['max_dev']
+    engine.strategy = header['strategy']
+    engine._group = tuple(header['group'])
+    engine._sizes = list(map(tuple, header['sizes']))
+    engine._allowed_pairs = header['allowed_pairs'] and list(
+        map(tuple, header['allowed_pairs']))
+    engine._a = item_or_none(header['a'])
+    engine._a_ix = header['a_ix']
+    engine._later = later
+    engine._bs = list(_from_u32s(bs))
+    engine._b_ix = header['b_ix']
+    engine._pairs = None if header['first_stage'] else _from_u32s(pairs)
+    engine._p_ix = header['p_ix']
+    engine._open = _from_u32s(open_pairs)
+    engine._pair = header['pair'] and tuple(map(item, header['pair']))
+    engine._stack = [[Relation(rel), *rest]
+        for rel, *rest in header['stack']]
+    engine.question = header['question'] and tuple(
+        map(item, header['question']))
+    engine._step = header['step'] and tuple(header['step'])
+    engine.done = header['done']
+    engine.n_answers = header['n_answers']
+    engine._max_undo = undo
+    engine._history = [] if undo else None
+    engine._derive()
+    return engine
+
+def _u32s(xs):
+    a = array('I', xs)
+    assert a.itemsize == 4
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a.tobytes()
+
+def _from_u32s(b):
+    a = array('I')
+    a.frombytes(b)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a
+
+def _table(bitsets):
+    data = [n.to_bytes((n.bit_length() + 7) // 8, 'little')
+        for n in bitsets]
+    offsets, total = [0], 0
+    for b in data:
+        total += len(b)
+        offsets.append(total)
+    return b''.join(
+        [len(data).to_bytes(8, 'little')] +
+        [o.to_bytes(8, 'little') for o in offsets] +
+        data)
+
+def _from_table(b):
+    n = int.from_bytes(b[:8], 'little')
+    offsets = [int.from_bytes(b[8 * i : 8 * i + 8], 'little')
+        for i in range(1, n + 2)]
+    data = b[8 * (n + 2):]
+    return [int.from_bytes(data[i:j], 'little')
+        for i, j in zip(offsets, offsets[1:])]
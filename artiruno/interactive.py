@@ -2,21 +2,23 @@
 to VDA. The session is initialized from the command line, and then
 the user's choices are read from standard input.'''
 
-import sys, json
+import sys, json, threading
 from artiruno.preorder import LT, EQ, GT
-from artiruno.vda import vda, Abort
+from artiruno.vda import Engine, Abort, Undo, _ItemSpace
 from artiruno._version import __version__
 
-def interact(criterion_names, alts, alt_names, **kwargs):
-    n_questions = 0
+# How many of the latest answers the user can take back. Each keeps a
+# record of what it changed, so this is kept small.
+UNDO_STEPS = 10
 
-    def asker(a, b):
-        nonlocal n_questions
+def interact(criterion_names, alts, alt_names,
+        resume = None, checkpoint = None, store = None, **kwargs):
+    '''Conduct VDA with the user at the terminal. If ``resume`` is provided, the session saved to that file is continued. If ``checkpoint`` is provided, the session is saved to that file after each answer. If ``store`` is provided, answers are remembered in that database file, and reused for the same criteria.'''
 
-        n_questions += 1
+    def asker(a, b):
         print('\nWhich do you prefer?')
 
-        options = dict(a = GT, b = LT, e = EQ, q = Abort)
+        options = dict(a = GT, b = LT, e = EQ, u = Undo, q = Abort)
         for k in 'a', 'b':
             item = dict(a = a, b = b)[k]
             print(f'\n({k})' + (
@@ -26,6 +28,7 @@ def interact(criterion_names, alts, alt_names, **kwargs):
                 print(f'- {name}: {value}' +
                     ('   <<< different' if a[i] != b[i] else ''))
         print('\n(e) The two options are equally preferable')
+        print('(u) Undo the previous answer')
         print('(q) Abort')
 
         print('')
@@ -43,14 +46,54 @@ def interact(criterion_names, alts, alt_names, **kwargs):
             if v is Abort:
                 print('Aborted.')
                 raise Abort()
+            if v is Undo:
+                raise Undo()
             return v
 
-    prefs = vda(
-        asker = asker,
-        alts = alts,
-        allowed_pairs_callback = apc,
-        **kwargs)
-    return prefs, n_questions
+    if store:
+        from artiruno.store import AnswerStore
+        store = AnswerStore(store)
+    engine = (
+        Engine.load(resume, allowed_pairs_callback = apc, store = store,
+            undo = UNDO_STEPS)
+        if resume else
+        Engine(alts = alts, allowed_pairs_callback = apc, store = store,
+            undo = UNDO_STEPS, **kwargs))
+    if (engine.criteria != tuple(map(tuple, kwargs['criteria'])) or
+            (None if alts is None else tuple(map(tuple, alts))) !=
+                (None if isinstance(engine.alts, _ItemSpace) else engine.alts) or
+            engine.find_best != kwargs.get('find_best') or
+            engine.max_dev != kwargs.get('max_dev', 2)):
+        raise ValueError(f"{resume} isn't a session for this scenario")
+    while (question := engine.next_question()) is not None:
+        # While the user thinks, work out what to ask next in another
+        # thread.
+        stop = threading.Event()
+        thread = threading.Thread(target = run_ahead,
+            args = (engine, stop), daemon = True)
+        thread.start()
+        try:
+            # Stop the other thread before we change the session in
+            # any way, including by `undo`.
+            try:
+                rel = asker(*question)
+            finally:
+                stop.set()
+                thread.join()
+        except Abort:
+            break
+        except Undo:
+            if not engine.undo():
+                print("There's no answer to undo.")
+            continue
+        engine.answer(rel)
+        if checkpoint:
+            engine.save(checkpoint)
+    return engine.prefs, engine.n_answers
+
+def run_ahead(engine, stop):
+    for _ in engine.speculate(stop.is_set):
+        pass
 
 def apc(allowed_pairs):
     if len(allowed_pairs) > 1:
@@ -101,6 +144,12 @@ def main():
         description = __doc__)
     args.add_argument('--version', action = 'version',
         version = 'Artiruno ' + __version__)
+    args.add_argument('--checkpoint', metavar = 'FILE',
+        help = 'save the session to FILE after each answer')
+    args.add_argument('--resume', metavar = 'FILE',
+        help = 'continue the session saved to FILE by --checkpoint')
+    args.add_argument('--store', metavar = 'FILE',
+        help = 'remember answers in the SQLite database FILE, and reuse them in sessions with the same criteria')
     args.add_argument('FILEPATH',
         help = 'path to a JSON file describing the scenario')
     args = args.parse_args()
@@ -109,7 +158,11 @@ def main():
         scenario = json.load(o)
 
     interact_args, alts, namer = setup_interactive(scenario)
-    prefs, n_questions = interact(**interact_args)
+    prefs, n_questions = interact(
+        resume = args.resume,
+        checkpoint = args.checkpoint,
+        store = args.store,
+        **interact_args)
     print(results_text(scenario, prefs, alts, n_questions, namer))
 
     try:
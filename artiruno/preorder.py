@@ -1,5 +1,5 @@
-import itertools, enum
-from collections import Counter
+import itertools, enum, copy, weakref
+from itertools import accumulate
 from artiruno.util import cmp, choose2
 
 class Relation(enum.Enum):
@@ -43,38 +43,154 @@ class PreorderedSet:
     '''A set equipped with a `preorder <https://en.wikipedia.org/wiki/Preorder>`_. Elements can be added to the set, and the order can be updated to make previously incomparable elements comparable.
 
     :param elements: An iterable of hashable objects to be ordered.
-    :param relations: An iterable of triples ``(a, b, rel)``, where ``a`` and ``b`` are objects in ``elements``, and ``rel`` is a :class:`Relation`. By default, all elements are incomparable to each other.
-    :param raw_relations: Used internally.'''
-
-    def __init__(self, elements = (), relations = (), raw_relations = None):
-        self.elements = set(elements)
-        self.relations = raw_relations or {(a, b): IC
+    :param relations: An iterable of triples ``(a, b, rel)``, where ``a`` and ``b`` are objects in ``elements``, and ``rel`` is a :class:`Relation`. By default, all elements are incomparable to each other.'''
+
+    def __init__(self, elements = (), relations = ()):
+        self.elements = set()
+        # Each element gets an integer ID. Equivalent elements are
+        # kept in classes with a union-find structure: `_parent[i]`
+        # leads toward the representative of the class of the element
+        # with ID `i`, and `_merged` is a bitset of the IDs that
+        # aren't representatives. For a representative `r`, `_up[r]`
+        # and `_down[r]` are bitsets of the elements known to be
+        # greater than, and less than, the class, and `_members[r]` is
+        # a bitset of the class, if it has more than one member. The
+        # entries for other IDs are stale. A new element thus costs
+        # only a few list entries.
+        self._ids = {}
+        self._items = []
+        self._parent = []
+        self._merged = 0
+        self._members = {}
+        self._up = []
+        self._down = []
+        # Weak references to the sets returned by
+        # `incomparable_pairs`.
+        self._watchers = []
+        # While there's a checkpoint, `_log` is a list of how to undo
+        # each change, and `_marks` has the length of `_log` at each
+        # checkpoint. See `_save` for the entries.
+        self._log = None
+        self._marks = []
+        self.update(sorted(elements))
+        self.learn_many(relations)
+
+    @property
+    def relations(self):
+        'A :class:`dict` mapping each pair of elements ``(a, b)``, with ``a < b``, to the :class:`Relation` between them.'
+        return {(a, b): self.cmp(a, b)
             for a, b in choose2(sorted(self.elements))}
-        for a, b, rel in relations:
-            self.learn(a, b, rel)
 
     def __repr__(self):
         return f'PreorderedSet({self.elements!r}, {self.relations!r})'
 
     def copy(self):
-        'Return a copy of the object.'
-        return type(self)(self.elements.copy(),
-            raw_relations = self.relations.copy())
+        'Return a copy of the object, without any checkpoints.'
+        new = object.__new__(type(self))
+        new.__dict__ = {k: copy.copy(v) for k, v in self.__dict__.items()}
+        new._watchers = []
+        new._log, new._marks = None, []
+        return new
 
     def add(self, x):
         "Add ``x`` to the set; a no-op if it's already there. ``x`` is initially incomparable to all other elements."
-        if x in self.elements:
-            return
-        for a in self.elements:
-            self.relations[(a, x) if a < x else (x, a)] = IC
-        self.elements.add(x)
+        if x not in self.elements:
+            self.update((x,))
+
+    def update(self, xs):
+        'Add each element of the iterable ``xs``, as with :meth:`add`, in one batch.'
+        xs = [x for x in dict.fromkeys(xs) if x not in self.elements]
+        if xs:
+            self._save('_truncate', _CALL, len(self._items))
+        ids = range(len(self._items), len(self._items) + len(xs))
+        self._ids.update(zip(xs, ids))
+        self._items.extend(xs)
+        self._parent.extend(ids)
+        self._up.extend(0 for _ in xs)
+        self._down.extend(0 for _ in xs)
+        self.elements.update(xs)
+
+    def _find(self, i):
+        # Return the representative of the class of the element with
+        # ID `i`, halving the path as we go. Under a checkpoint, the
+        # halving is logged like any other change, since rolling back
+        # a merge could otherwise leave an element pointing into the
+        # wrong class.
+        parent, log = self._parent, self._log
+        while parent[i] != i:
+            g = parent[parent[i]]
+            if log is not None and g != parent[i]:
+                log.append(('_parent', i, parent[i]))
+            parent[i] = i = g
+        return i
+
+    def _truncate(self, n):
+        # Remove the elements with IDs `n` and up, for `rollback`.
+        for x in self._items[n:]:
+            del self._ids[x]
+            self.elements.discard(x)
+        for xs in self._items, self._parent, self._up, self._down:
+            del xs[n:]
+
+    def _reps(self):
+        # Yield the ID of each representative.
+        return (r for r, p in enumerate(self._parent) if r == p)
+
+    def _class(self, r):
+        # Return a bitset of the class with representative `r`.
+        return self._members.get(r) or 1 << r
 
     def cmp(self, a, b):
         'Return the :class:`Relation` between ``a`` and ``b``.'
-        if a == b:
-            assert a in self.elements and b in self.elements
-            return EQ
-        return self.relations[a, b] if a < b else -self.relations[b, a]
+        return self._cmp_ids(self._ids[a], self._ids[b])
+
+    def _cmp_ids(self, r, s):
+        # As `cmp`, but for the elements with IDs `r` and `s`.
+        if self._parent[r] != r:
+            r = self._find(r)
+        if self._parent[s] != s:
+            s = self._find(s)
+        return self._rel(r, s)
+
+    def _rel(self, r, s):
+        # Return the relation between the classes with representatives
+        # `r` and `s`.
+        return (
+            EQ if r == s else
+            LT if self._up[r] >> s & 1 else
+            GT if self._down[r] >> s & 1 else
+            IC)
+
+    def _ups(self, r):
+        # Return a bitset of the elements known to be greater than the
+        # class with representative `r`. Subclasses can add relations
+        # they don't store in `_up`.
+        return self._up[r]
+
+    def _downs(self, r):
+        # The counterpart of `_ups`.
+        return self._down[r]
+
+    def _implied(self, r, s):
+        # Return true if `_ups` and `_downs` already imply that the
+        # class of `r` is less than that of `s`, even though `_up` and
+        # `_down` don't say so.
+        return False
+
+    def _like(self, elements):
+        # Return a new object of the same type with the given
+        # `elements` and no relations.
+        return type(self)(elements)
+
+    def ancestors(self, x):
+        'Return the set of elements known to be greater than ``x``. These are the ancestors of ``x`` in :meth:`graph`.'
+        r = self._find(self._ids[x])
+        return frozenset(map(self._items.__getitem__, _bits(self._ups(r))))
+
+    def descendants(self, x):
+        'Return the set of elements known to be less than ``x``. These are the descendants of ``x`` in :meth:`graph`.'
+        r = self._find(self._ids[x])
+        return frozenset(map(self._items.__getitem__, _bits(self._downs(r))))
 
     def extreme(self, n, among = None, bottom = False):
         '''Return the top-``n`` subset (or bottom-``n`` subset, if ``bottom`` is true) of the items in the set ``among``, or of the whole set if ``among`` is not provided.
@@ -86,11 +202,32 @@ class PreorderedSet:
 
         We define the bottom-``n`` subset similarly, with the inequality in the other direction. Notice that the top-``n`` subset may contain more or less than ``n`` items.'''
 
-        return frozenset(x
-            for x in among or self.elements
-            for cmps in [Counter(
-                self.cmp(x, a) for a in among or self.elements)]
-            if cmps[IC] == 0 and cmps[GT if bottom else LT] < n)
+        # Count relations by masking each class's bitsets with
+        # `among`, so we needn't compare every pair.
+        ids = {x: self._ids[x] for x in among or self.elements}
+        mask = _bitset(ids.values())
+        result = set()
+        for x, i in ids.items():
+            r = self._find(i)
+            up, down = self._ups(r) & mask, self._downs(r) & mask
+            if (_popcount(up | down | self._class(r) & mask) == len(ids) and
+                    _popcount(down if bottom else up) < n):
+                result.add(x)
+        return frozenset(result)
+
+    def ranking(self, among = None):
+        """Return a best-effort ranking of the items in ``among``, or of the whole set if ``among`` is not provided, as a list of sets, best first. The first set has the items that no other item is known to be greater than. The next has the items that only items of the first set are known to be greater than, and so on. So, each item is in a later set than every item known to be greater than it, and items that are incomparable can share a set."""
+
+        ids = {x: self._ids[x] for x in among or self.elements}
+        mask = _bitset(ids.values())
+        ups = {x: self._ups(self._find(i)) & mask for x, i in ids.items()}
+        result = []
+        while ids:
+            level = {x for x in ids if not ups[x] & mask}
+            result.append(frozenset(level))
+            for x in level:
+                mask &= ~(1 << ids.pop(x))
+        return result
 
     def maxes(self, among = None):
         'Return all the maxima among the items in ``among``, or the whole set if ``among`` is not provided. The maxima are defined as the top-1 subset, per :meth:`extreme`.'
@@ -99,28 +236,6 @@ class PreorderedSet:
         'As ``maxes``, but for minima.'
         return self.extreme(1, among, bottom = True)
 
-    def _set(self, a, b, rel):
-        # Return true if a change was made.
-        assert rel in (LT, EQ, GT)
-
-        if a == b:
-             assert a in self.elements
-             if rel != EQ:
-                 raise ContradictionError((a, b), EQ, rel)
-             return False
-
-        k = (a, b)
-        if b < a:
-           k, rel = (b, a), -rel
-
-        if self.relations[k] == IC:
-            self.relations[k] = rel
-            return True
-        elif self.relations[k] == rel:
-            return False
-        else:
-            raise ContradictionError(k, self.relations[k], rel)
-
     def learn(self, a, b, rel):
         '''Update the ordering such that ``a`` and ``b`` are related by ``rel``, a :class:`Relation` other than :const:`IC <Relation.IC>`. Any other relations that can be inferred by transitivity will be added to the set.
 
@@ -128,37 +243,249 @@ class PreorderedSet:
 
         Raise :class:`ContradictionError` if the new relation isn't consistent with the preexisting relations (other than incomparability).'''
 
-        if not self._set(a, b, rel):
+        out = self._learn(a, b, rel)
+        self._notify(out)
+        return out
+
+    def learn_many(self, triples):
+        '''Like :meth:`learn`, but for each triple ``(a, b, rel)`` in the iterable ``triples``, in order. Return the combined list of updated pairs. If any of them raises an exception, such as :class:`ContradictionError`, none of them are kept.'''
+
+        triples = list(triples)
+        self.checkpoint()
+        out = []
+        try:
+            for a, b, rel in triples:
+                out.extend(self._learn(a, b, rel))
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+        self._notify(out)
+        return out
+
+    def merge(self, other):
+        '''Add the elements of the :class:`PreorderedSet` ``other``, and all the relations it knows, as with :meth:`learn_many`. On a contradiction or any other error, ``self`` is left unchanged, including its elements.'''
+
+        def triples():
+            for r in other._reps():
+                a = other._items[r]
+                for m in _bits(other._class(r) & ~(1 << r)):
+                    yield a, other._items[m], EQ
+                for s in _bits(other._ups(r) & ~other._merged):
+                    yield a, other._items[s], LT
+        self.checkpoint()
+        try:
+            self.update(sorted(other.elements))
+            out = self.learn_many(triples())
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+        return out
+
+    def _learn(self, a, b, rel):
+        # Do the work of `learn`, except for notifying the sets from
+        # `incomparable_pairs`.
+        assert rel in (LT, EQ, GT)
+        was = self.cmp(a, b)
+        if was == rel:
             return []
-        # Use a modification of Warshall's algorithm to update the transitive
-        # closure.
-        # https://web.archive.org/web/2013/https://cs.winona.edu/lin/cs440/ch08-2.pdf
-        changed = [(a, b) if a < b else (b, a)]
-        for k, i, j in itertools.product((a, b), self.elements, self.elements):
-            r1, r2 = self.cmp(i, k), self.cmp(k, j)
-            if (r1 != IC and r2 == EQ) or (r1 == LT == r2):
-                if self._set(i, j, r1):
-                    changed.append((i, j) if i < j else (j, i))
-        return changed
+        if was != IC:
+            if b < a:
+                a, b, was, rel = b, a, -was, -rel
+            raise ContradictionError((a, b), was, rel)
+
+        # Since the existing order is transitively closed, and it
+        # doesn't contradict the new relation, no inferred relation
+        # can contradict it, either. So we only need to put everything
+        # that's now known to be less than or equal to `a` below
+        # everything that's now known to be greater than or equal to
+        # `b`, and collect the pairs of classes that became comparable.
+        i, j = self._ids[a], self._ids[b]
+        r, s = self._find(i), self._find(j)
+        if rel == GT:
+            r, s, rel = s, r, LT
+        if rel == LT:
+            down = self._downs(r) | self._class(r)
+            up = self._ups(s) | self._class(s)
+        else:
+            both = self._class(r) | self._class(s)
+            down = self._downs(r) | self._downs(s) | both
+            up = self._ups(r) | self._ups(s) | both
+        changed = {}
+        self._link(down, up, changed)
+
+        out = [(a, b) if a < b else (b, a)]
+        for x, y in changed:
+            for m in _bits(self._class(x)):
+                for n in _bits(self._class(y)):
+                    if {m, n} != {i, j}:
+                        a, b = self._items[m], self._items[n]
+                        out.append((a, b) if a < b else (b, a))
+
+        if rel == EQ:
+            for name, k in (('_parent', s), ('_merged', _ATTR),
+                    ('_members', s), ('_members', r),
+                    ('_up', r), ('_down', r)):
+                self._save(name, k)
+            self._parent[s] = r
+            self._merged |= 1 << s
+            self._members.pop(s, None)
+            self._members[r] = both
+            self._up[r] = up & ~both
+            self._down[r] = down & ~both
+        return out
+
+    def _link(self, down, up, changed):
+        # Record that every element of the bitset `down` is less than
+        # or equal to every element of the bitset `up`. Each pair of
+        # representatives whose relation changed is added to the
+        # dictionary `changed`.
+        live = ~self._merged
+        log = self._log
+        for x in _bits(down & live):
+            new = up & ~self._up[x] & ~self._class(x) & live
+            for y in _bits(new):
+                if (y, x) not in changed and not self._implied(x, y):
+                    changed[x, y] = None
+            if log is not None:
+                log.append(('_up', x, self._up[x]))
+            self._up[x] |= up
+        for y in _bits(up & live):
+            if log is not None:
+                log.append(('_down', y, self._down[y]))
+            self._down[y] |= down
+
+    def checkpoint(self):
+        """Start recording changes to the set, so they can be undone with :meth:`rollback`. Checkpoints can be nested, and :meth:`rollback` and :meth:`commit` each end the latest one. Recording costs time and memory in proportion to the changes, not the size of the set, so this is a cheap way to try out a hypothetical :meth:`learn`. The sets from :meth:`incomparable_pairs` are restored by :meth:`rollback`, too."""
+        if self._log is None:
+            self._log = []
+        self._marks.append(len(self._log))
+
+    def rollback(self):
+        'Undo all the changes since the latest :meth:`checkpoint`, and end it.'
+        mark = self._marks.pop()
+        log = self._log
+        while len(log) > mark:
+            name, k, old = log.pop()
+            if callable(name):
+                name(old)
+            elif k is _ATTR:
+                setattr(self, name, old)
+            elif k is _CALL:
+                getattr(self, name)(old)
+            elif old is _MISSING:
+                getattr(self, name).pop(k, None)
+            else:
+                getattr(self, name)[k] = old
+        if not self._marks:
+            self._log = None
+
+    def commit(self):
+        "Keep the changes since the latest :meth:`checkpoint`, and end it. If it's nested in another checkpoint, the changes can still be undone by rolling back that one."
+        self._marks.pop()
+        if not self._marks:
+            self._log = None
+
+    def _forget_oldest(self):
+        # End the earliest checkpoint, keeping its changes, so they
+        # can no longer be undone and their log entries are freed.
+        # The later checkpoints are unaffected.
+        marks = self._marks
+        if len(marks) == 1:
+            return self.commit()
+        n = marks[1] - marks[0]
+        del self._log[marks[0] : marks[1]]
+        marks[:] = [m - n for m in marks[1:]]
+
+    def _save(self, name, k, arg = None):
+        # Log how to undo a change, for `rollback`. With `k` being
+        # `_ATTR`, the attribute `name` is about to change. With
+        # `_CALL`, the change can be undone by calling the method
+        # `name` on `arg`. Otherwise, the item `k` of the list or
+        # dictionary `name` is about to change, or to be created.
+        # Entries refer to attributes by name, so they still apply
+        # after our attributes are replaced with those of a copy.
+        if self._log is None:
+            return
+        if k is _CALL:
+            self._log.append((name, k, arg))
+            return
+        xs = getattr(self, name)
+        self._log.append((name, k,
+            xs if k is _ATTR else
+            xs.get(k, _MISSING) if isinstance(xs, dict) else
+            xs[k]))
+
+    def _notify(self, changed):
+        # Remove the newly comparable pairs `changed` from each live
+        # set from `incomparable_pairs`.
+        live = []
+        for ref in self._watchers:
+            if (pairs := ref()) is not None:
+                live.append(ref)
+                for a, b in changed:
+                    for pair in (a, b), (b, a):
+                        if pair in pairs:
+                            pairs.remove(pair)
+                            if self._log is not None:
+                                self._log.append((pairs.add, None, pair))
+        self._watchers = live
+
+    def incomparable_pairs(self, pairs):
+        '''Return a :class:`set` of the pairs ``(a, b)`` from the iterable ``pairs`` such that ``a`` and ``b`` are incomparable. The set is live: :meth:`learn` removes each pair from it as soon as the pair becomes comparable, so keeping it up to date costs time proportional to the number of changes, rather than the number of pairs. The caller can also remove pairs from it.'''
+
+        result = {(a, b) for a, b in pairs if self.cmp(a, b) == IC}
+        self._watchers.append(weakref.ref(result))
+        return result
 
     def get_subset(self, elements):
         'Return a new :class:`PreorderedSet` that contains only the requested ``elements``.'
 
         elements = frozenset(elements)
         assert elements.issubset(self.elements)
-        return type(self)(elements, raw_relations = {(a, b): r
-            for (a, b), r in self.relations.items()
-            if {a, b}.issubset(elements)})
+        new = self._like(elements)
+        old_ids = [self._ids[x] for x in new._items]
+        mask = _bitset(old_ids)
+        def remap(bits):
+            return _bitset(new._ids[self._items[i]]
+                for i in _bits(bits & mask))
+
+        # The old order is transitively closed, so we can copy the
+        # classes and their bitsets without inferring anything.
+        new_reps = {}
+        for i, old_i in enumerate(old_ids):
+            r = self._find(old_i)
+            if r in new_reps:
+                new._parent[i] = new_reps[r]
+                new._merged |= 1 << i
+                new._members[new_reps[r]] = (
+                    new._class(new_reps[r]) | 1 << i)
+                continue
+            new_reps[r] = i
+            new._up[i] = remap(self._up[r])
+            new._down[i] = remap(self._down[r])
+        return new
 
     def summary(self, namer = str):
         'Describe all the relations with a string like "A<B C<D E=F". ``namer`` should be a callback that returns a name for an element, as a string.'
         return ' '.join(
             '{}{}{}'.format(
                 namer(a), {EQ: '=', LT: '<'}[rel], namer(b))
-            for a, b, rel in sorted(
-                (b, a, LT) if rel == GT else (a, b, rel)
-                for (a, b), rel in self.relations.items()
-                if rel != IC))
+            for a, b, rel in sorted(self._known()))
+
+    def _known(self):
+        # Yield a triple `(a, b, rel)`, with `rel` either `LT` or `EQ`,
+        # for each pair of comparable elements, without touching
+        # pairs that are still incomparable. For `EQ`, `a < b`.
+        for r in self._reps():
+            members = sorted(map(self._items.__getitem__,
+                _bits(self._class(r))))
+            for a, b in choose2(members):
+                yield a, b, EQ
+            for b in map(self._items.__getitem__, _bits(self._ups(r))):
+                for a in members:
+                    yield a, b, LT
 
     def graph(self, namer = str):
         'Return the set represented as a :class:`graphviz.Source` object. Requires the Python package ``graphviz``. ``namer`` should be a callback that returns a name for an element, as a string.'
@@ -169,14 +496,9 @@ class PreorderedSet:
         g = graphviz.Digraph()
 
         # Collect groups of equivalent items into nodes.
-        nodes = []
-        for a in sorted(self.elements):
-            for node in nodes:
-                if self.cmp(a, node[0]) == EQ:
-                    node.append(a)
-                    break
-            else:
-                nodes.append([a])
+        nodes = sorted(
+            sorted(map(self._items.__getitem__, _bits(self._class(r))))
+            for r in self._reps())
 
         # Add the nodes to the graph.
         def node_repr(node):
@@ -194,3 +516,202 @@ class PreorderedSet:
         return graphviz.Source(subprocess
             .Popen(['tred'], stdin = subprocess.PIPE, stdout = subprocess.PIPE)
             .communicate(g.source.encode('UTF-8'))[0].decode('UTF-8'))
+
+class DominancePreorderedSet(PreorderedSet):
+    '''A :class:`PreorderedSet` of items, which enforces the assumption that on any single criterion, bigger values are better. So, if one item is at least as good as another on every criterion, it's at least as good overall. These relations of dominance are computed from ``criteria`` as needed instead of being stored, so only relations passed to :meth:`learn <PreorderedSet.learn>`, and their consequences, take up space.
+
+    :param criteria: As in :func:`vda`.
+    :param implicit: If true, the set acts as if it contains the whole item space: any item is added the first time it's passed to :meth:`cmp <PreorderedSet.cmp>`, :meth:`learn <PreorderedSet.learn>`, :meth:`ancestors <PreorderedSet.ancestors>`, :meth:`descendants <PreorderedSet.descendants>`, or the ``among`` of :meth:`extreme <PreorderedSet.extreme>`.'''
+
+    def __init__(self, criteria, elements = (), relations = (),
+            implicit = False):
+        self.criteria = tuple(map(tuple, criteria))
+        self.implicit = implicit
+        self._level_ix = [{v: i for i, v in enumerate(c)}
+            for c in self.criteria]
+        # `_levels[i]` is the element with ID `i`, with each criterion
+        # value replaced by its index in the criterion.
+        self._levels = []
+        # `_codes[i]` packs `_levels[i]` into one integer, such that
+        # comparing codes is the same as comparing the tuples.
+        self._codes = []
+        self._radices = [1]
+        for c in reversed(self.criteria[1:]):
+            self._radices.insert(0, self._radices[0] * len(c))
+        # `_ge[c][k]` is a bitset of the elements whose value on
+        # criterion `c` is at level `k` or better, and `_le[c][k]`,
+        # at level `k` or worse. Intersecting one per criterion gives
+        # everything that dominates, or is dominated by, an item.
+        self._ge = [[0] * len(c) for c in self.criteria]
+        self._le = [[0] * len(c) for c in self.criteria]
+        # A bitset of the elements whose bitsets say more than
+        # dominance does.
+        self._touched = 0
+        super().__init__(elements, relations)
+
+    def _like(self, elements):
+        return type(self)(self.criteria, elements,
+            implicit = self.implicit)
+
+    def copy(self):
+        new = super().copy()
+        new._ge = [t.copy() for t in self._ge]
+        new._le = [t.copy() for t in self._le]
+        return new
+
+    def update(self, xs):
+        n = len(self._items)
+        super().update(xs)
+        self._levels.extend(
+            tuple(ix[v] for ix, v in zip(self._level_ix, x))
+            for x in self._items[n:])
+        self._codes.extend(
+            sum(map(int.__mul__, levels, self._radices))
+            for levels in self._levels[n:])
+        for c, (ge, le) in enumerate(zip(self._ge, self._le)):
+            at = [[] for _ in ge]
+            for i, levels in enumerate(self._levels[n:]):
+                at[levels[c]].append(i)
+            at = [_bitset(ids) << n for ids in at]
+            for k, bits in enumerate(accumulate(reversed(at), int.__or__)):
+                ge[-1 - k] |= bits
+            for k, bits in enumerate(accumulate(at, int.__or__)):
+                le[k] |= bits
+        if self._touched:
+            for i in range(n, len(self._items)):
+                self._inherit(i)
+
+    def _inherit(self, i):
+        # Give the new element with ID `i` the stored relations of the
+        # items that dominate it or are dominated by it. Nothing else
+        # needs to change, because the new element can't link any two
+        # existing items that dominance doesn't already link.
+        up = down = 0
+        for z in _bits(self._dominating(i, self._ge) & self._touched):
+            r = self._find(z)
+            up |= self._up[r] | self._class(r)
+        for z in _bits(self._dominating(i, self._le) & self._touched):
+            r = self._find(z)
+            down |= self._down[r] | self._class(r)
+        if up or down:
+            self._up[i] = up
+            self._down[i] = down
+            for r in _bits(up & ~self._merged):
+                self._save('_down', r)
+                self._down[r] |= 1 << i
+            for r in _bits(down & ~self._merged):
+                self._save('_up', r)
+                self._up[r] |= 1 << i
+            self._save('_touched', _ATTR)
+            self._touched |= 1 << i
+
+    def _truncate(self, n):
+        super()._truncate(n)
+        del self._levels[n:], self._codes[n:]
+        mask = (1 << n) - 1
+        for table in self._ge + self._le:
+            for k, bits in enumerate(table):
+                table[k] = bits & mask
+        self._touched &= mask
+
+    def _dominating(self, i, table):
+        # Return a bitset of the elements other than `i` that are at
+        # least as good as it on every criterion (with `table` being
+        # `_ge`) or at least as bad (with `_le`).
+        bits = -1
+        for t, k in zip(table, self._levels[i]):
+            bits &= t[k]
+        return bits & ~(1 << i)
+
+    def _dominance(self, i, j):
+        # Return the relation between the elements with IDs `i` and
+        # `j` implied by dominance alone.
+        lt = gt = False
+        for a, b in zip(self._levels[i], self._levels[j]):
+            if a < b:
+                if gt:
+                    return IC
+                lt = True
+            elif a > b:
+                if lt:
+                    return IC
+                gt = True
+        return LT if lt else GT if gt else EQ
+
+    def cmp(self, a, b):
+        if self.implicit and not (a in self._ids and b in self._ids):
+            self.update((a, b))
+        return super().cmp(a, b)
+
+    def _cmp_ids(self, i, j):
+        rel = super()._cmp_ids(i, j)
+        return self._dominance(i, j) if rel == IC else rel
+
+    def ancestors(self, x):
+        if self.implicit:
+            self.add(x)
+        return super().ancestors(x)
+
+    def descendants(self, x):
+        if self.implicit:
+            self.add(x)
+        return super().descendants(x)
+
+    def extreme(self, n, among = None, bottom = False):
+        if self.implicit and among is not None:
+            self.update(among)
+        return super().extreme(n, among, bottom)
+
+    def ranking(self, among = None):
+        if self.implicit and among is not None:
+            self.update(among)
+        return super().ranking(among)
+
+    def _ups(self, r):
+        return self._up[r] | self._dominating(r, self._ge)
+
+    def _downs(self, r):
+        return self._down[r] | self._dominating(r, self._le)
+
+    def _implied(self, r, s):
+        return self._dominance(r, s) == LT
+
+    def _learn(self, a, b, rel):
+        changed = super()._learn(a, b, rel)
+        self._save('_touched', _ATTR)
+        for x in a, b:
+            r = self._find(self._ids[x])
+            self._touched |= self._up[r] | self._down[r] | self._class(r)
+        return changed
+
+    def get_subset(self, elements):
+        new = super().get_subset(elements)
+        new._touched = _bitset(i
+            for i in range(len(new._items))
+            for r in [new._find(i)]
+            if new._up[r] or new._down[r] or r in new._members)
+        return new
+
+# Special values for the undo log.
+_ATTR, _CALL, _MISSING = object(), object(), object()
+
+def _bits(n):
+    # Yield the indices of the 1s in the binary representation of
+    # `n`, from least to most significant.
+    while n:
+        low = n & -n
+        yield low.bit_length() - 1
+        n ^= low
+
+def _bitset(ids):
+    # The inverse of `_bits`: return an integer with a 1 at each index
+    # in the iterable `ids`. Setting bits in a byte array first avoids
+    # building a new big integer for each index.
+    ids = list(ids)
+    b = bytearray(max(ids, default = -1) // 8 + 1)
+    for i in ids:
+        b[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(b, 'little')
+
+_popcount = getattr(int, 'bit_count', lambda n: bin(n).count('1'))
+  # `int.bit_count` is new in Python 3.10.
@@ -0,0 +1,61 @@
+'''A persistent store of the user's answers, so that sessions with the same criteria can reuse them instead of asking again.'''
+
+import json, sqlite3
+from artiruno.preorder import Relation
+
+class AnswerStore:
+    '''Answers to questions, kept in an SQLite database and keyed by the criteria and the pair of items. Pass an ``AnswerStore`` to :func:`artiruno.vda` as ``store`` to load all the answers for the same criteria before the first question, and to record new answers as they're given. This also allows replaying a recorded session without an asker.
+
+    Criterion levels have to be representable in JSON.
+
+    :param path: The path of the database file, which is created if necessary. Use ``':memory:'`` for a store that lasts only as long as the object.'''
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        with self.db:
+            self.db.execute('''create table if not exists answers
+                (criteria text, a text, b text, rel integer,
+                    primary key (criteria, a, b))''')
+
+    def get(self, criteria, a, b):
+        'Return the stored :class:`Relation <artiruno.Relation>` of ``a`` to ``b``, or :data:`py:None` if there is none.'
+        k, a, b, sign = _key(criteria, a, b)
+        row = self.db.execute(
+            'select rel from answers where criteria = ? and a = ? and b = ?',
+            (k, a, b)).fetchone()
+        return None if row is None else Relation(sign * row[0])
+
+    def put(self, criteria, a, b, rel):
+        'Store ``rel`` as the relation of ``a`` to ``b``, replacing any previous answer.'
+        k, a, b, sign = _key(criteria, a, b)
+        with self.db:
+            self.db.execute(
+                'insert or replace into answers values (?, ?, ?, ?)',
+                (k, a, b, sign * rel.value))
+
+    def delete(self, criteria, a, b):
+        'Remove any stored answer for ``a`` and ``b``.'
+        k, a, b, _ = _key(criteria, a, b)
+        with self.db:
+            self.db.execute(
+                'delete from answers where criteria = ? and a = ? and b = ?',
+                (k, a, b))
+
+    def triples(self, criteria):
+        'Return a list of triples ``(a, b, rel)``, suitable for :meth:`learn_many <artiruno.PreorderedSet.learn_many>`, of all the answers stored for ``criteria``.'
+        return [(tuple(json.loads(a)), tuple(json.loads(b)), Relation(rel))
+            for a, b, rel in self.db.execute(
+                'select a, b, rel from answers where criteria = ? order by rowid',
+                (_criteria_key(criteria),))]
+
+    def close(self):
+        self.db.close()
+
+def _criteria_key(criteria):
+    return json.dumps([list(c) for c in criteria])
+
+def _key(criteria, a, b):
+    # Each pair is stored only once, in a canonical order. `sign` is
+    # -1 if we had to swap `a` and `b`.
+    a, b = json.dumps(list(a)), json.dumps(list(b))
+    return (_criteria_key(criteria),) + ((a, b, 1) if a <= b else (b, a, -1))
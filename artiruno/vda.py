@@ -1,20 +1,21 @@
-from itertools import accumulate, combinations, product
-import re
-import inspect
-from artiruno.preorder import PreorderedSet, Relation, IC, LT, EQ, GT
-from artiruno.util import cmp, choose2
+import time, copy
+from itertools import combinations, product
+from array import array
+from collections.abc import Sequence
+from math import prod
+from artiruno.preorder import (DominancePreorderedSet, ContradictionError,
+    IC, LT, EQ, GT, _bits, _bitset, _popcount)
 
-class Jump(Exception):
-    def __init__(self, value):
-        self.value = value
+class Abort(Exception):
+    'An asker can raise this to end the analysis early. :func:`vda` and :func:`avda` then return the preferences learned so far.'
+class Undo(Exception):
+    'An asker can raise this to take back the previous answer, if the ``undo`` parameter of :func:`vda` or :func:`avda` allows it.'
 
-class Abort(Exception): pass
-
-avda_doc = 'As :func:`vda`, but accepts an asynchronous ``asker``.'
-
-async def avda(
+def vda(
         criteria, alts = None, asker = None, find_best = None,
-        max_dev = 2, allowed_pairs_callback = lambda x: None):
+        max_dev = 2, allowed_pairs_callback = lambda x: None,
+        store = None, strategy = 'order', max_questions = None,
+        deadline = None, undo = 0):
     '''Conduct verbal decision analysis.
 
     :param criteria: An iterable of iterables specifying the levels of each criterion. Levels can be any hashable object, but are typically strings. Within a criterion, we assume that later levels are better.
@@ -23,109 +24,775 @@ async def avda(
     :param find_best: An integer. If set, Artiruno will aim to identify the top ``find_best`` items and stop there. Otherwise, Artiruno will try to compare all the alternatives.
     :param max_dev: The maximum number of criteria on which hypothetical items can deviate from the reference item when asking the user to make choices. It's summed across both items; e.g., ``max_dev = 5`` allows 4 deviant criteria compared to 1 deviant criterion, or 3 compared to 2.
     :param allowed_pairs_callback: Called on ``allowed_pairs`` for each iteration of the outermost loop.
+    :param store: An :class:`artiruno.store.AnswerStore`, or another object with the same methods. If provided, all its answers for ``criteria`` are learned before the first question, it's consulted before anything is asked, and new answers are saved to it. Stored answers that contradict each other are skipped.
+    :param strategy: How to choose among the questions that could be asked next. With ``'order'``, Artiruno asks the first one it finds. With ``'informative'``, it considers all those that could be asked in the same step of the search, and asks the one that, averaged over the possible answers, would make the most pairs of alternatives comparable. This takes more computation per question. ``benchmark.py --simulate`` compares the two.
+    :param max_questions: If set, stop after this many questions have been answered.
+    :param deadline: A number of seconds. If set, stop asking questions once this much time has passed since the call began. :func:`vda` can't interrupt the asker, so only :func:`avda` stops in the middle of a question, by cancelling it.
+    :param undo: The number of the latest answers that can be taken back. If it's more than 0, the asker can raise :class:`Undo <artiruno.vda.Undo>` to take back the last answer, per :meth:`Engine.undo`, and be asked that question again. Each answer that can be taken back keeps a record of what it changed, so this should be small.
+
+    :returns: A :class:`PreorderedSet`. Its elements will be a subset of the item space and a superset of ``alts``. If ``alts`` is :data:`py:None`, items are added to it as they're needed, so the item space is never enumerated at once, and the set adds any other item the first time it's compared.
+
+    If the analysis stops early, because of ``max_questions``, ``deadline``, or :class:`Abort <artiruno.vda.Abort>`, the returned preferences are still everything learned so far. :meth:`PreorderedSet.ranking` gives a best-effort ranking from them, and :meth:`PreorderedSet.incomparable_pairs` gives the pairs left unresolved.'''
+
+    engine = Engine(criteria, alts, find_best, max_dev,
+        allowed_pairs_callback, store, strategy, undo)
+    end = deadline and time.monotonic() + deadline
+    while not _over(engine, max_questions, end) and (
+            (question := engine.next_question()) is not None):
+        try:
+            rel = asker(*question)
+        except Abort:
+            break
+        except Undo:
+            engine.undo()
+            continue
+        engine.answer(rel)
+    return engine.prefs
+
+async def avda(
+        criteria, alts = None, asker = None, find_best = None,
+        max_dev = 2, allowed_pairs_callback = lambda x: None,
+        store = None, strategy = 'order', max_questions = None,
+        deadline = None, batch = 1, speculate = False, undo = 0):
+    '''As :func:`vda`, but accepts an asynchronous ``asker``.
+
+    :param batch: The most questions to have pending at once. If it's more than 1, questions are taken from :meth:`Engine.next_questions` and asked concurrently. Each answer is applied as it arrives, and pending questions that it settles are cancelled. This can save time when the asker can answer several questions at once, at the cost of sometimes asking questions that one at a time would've been unnecessary.
+    :param speculate: If true, while waiting for each answer, run :meth:`Engine.speculate` in slices of a few milliseconds between turns of the event loop, so that the next question is ready as soon as the answer arrives. This is ignored when ``batch`` is more than 1.'''
+
+    engine = Engine(criteria, alts, find_best, max_dev,
+        allowed_pairs_callback, store, strategy, undo)
+    end = deadline and time.monotonic() + deadline
+    while not _over(engine, max_questions, end) and (
+            (question := engine.next_question()) is not None):
+        try:
+            if batch > 1:
+                n = batch
+                if max_questions is not None:
+                    n = min(n, max_questions - engine.n_answers)
+                if not await _ask_batch(
+                        engine, asker, engine.next_questions(n), end):
+                    break
+                continue
+            answer = asker(*question)
+            if speculate:
+                answer = _speculating(engine, answer)
+            if end is None:
+                rel = await answer
+            else:
+                import asyncio
+                try:
+                    rel = await asyncio.wait_for(answer,
+                        end - time.monotonic())
+                except asyncio.TimeoutError:
+                    break
+        except Abort:
+            break
+        except Undo:
+            engine.undo()
+            continue
+        engine.answer(rel)
+    return engine.prefs
+
+async def _ask_batch(engine, asker, questions, end):
+    # Ask `questions` concurrently for `avda`, applying the answers
+    # as they arrive. Return false if we ran out of time.
+    import asyncio
+    prefs = engine.prefs
+    tasks = {asyncio.ensure_future(asker(*q)): q for q in questions}
+    try:
+        while tasks:
+            done, _ = await asyncio.wait(tasks,
+                timeout = None if end is None else end - time.monotonic(),
+                return_when = asyncio.FIRST_COMPLETED)
+            if not done:
+                return False
+            for task in done:
+                q = tasks.pop(task)
+                rel = task.result()
+                if prefs.cmp(*q) != IC:
+                    # An earlier answer settled it while it was pending.
+                    continue
+                if q == engine.question:
+                    engine.answer(rel)
+                else:
+                    engine.tell(*q, rel)
+            for task, q in list(tasks.items()):
+                if prefs.cmp(*q) != IC:
+                    task.cancel()
+                    del tasks[task]
+        return True
+    finally:
+        for task in tasks:
+            task.cancel()
 
-    :returns: A :class:`PreorderedSet`. Its elements will be a subset of the item space and a superset of ``alts``.'''
-
-    criteria, alts, prefs = _setup(criteria, alts)
-    assert 2 <= max_dev <= 2*len(criteria)
-    if find_best:
-        assert 1 <= find_best <= len(alts)
-
-    async def get_pref(a, b):
-        add_items(criteria, prefs, [a, b])
-        if (rel := prefs.cmp(a, b)) == IC:
-            rel = await asker(a, b)
-            prefs.learn(a, b, rel)
-        return rel
-
-    def dev_from_ref(dev_criteria, vector):
-        # Return a vector in the item space that deviates from the
-        # best possible item on the given criteria with the given
-        # values.
-        return tuple(
-           vector[i] if i in dev_criteria else c[-1]
-           for i, c in enumerate(criteria))
-
-    def num_item(item):
-        # Represent criterion values as integers. This prevents us
+async def _speculating(engine, answer, seconds = .005):
+    # Await `answer` for `avda`, running `engine.speculate` meanwhile.
+    # We yield to the event loop before each step, so the asker can
+    # show the question first, and at least every `seconds` within a
+    # step, so the answer can arrive without waiting for the step to
+    # finish.
+    import asyncio
+    task = asyncio.ensure_future(answer)
+    until = None
+    def pause():
+        return time.monotonic() >= until
+    try:
+        await asyncio.sleep(0)
+        until = time.monotonic() + seconds
+        for _ in engine.speculate(pause = pause):
+            if task.done():
+                break
+            await asyncio.sleep(0)
+            until = time.monotonic() + seconds
+        return await task
+    finally:
+        task.cancel()
+
+def _over(engine, max_questions, end):
+    # Check whether `vda` or `avda` is out of questions or time.
+    return ((max_questions is not None and
+            engine.n_answers >= max_questions) or
+        (end is not None and time.monotonic() >= end))
+
+class Engine:
+    '''The state of a session of verbal decision analysis, which asks one question at a time. :func:`vda` and :func:`avda` are drivers for this class that take the answers from an ``asker``. Using it directly lets the caller put a session aside between questions. All the state is kept as ordinary data in attributes, rather than in a suspended call stack.
+
+    The parameters are as in :func:`vda`. The preferences learned so far are in the attribute ``prefs``, a :class:`PreorderedSet`, and the number of questions answered is ``n_answers``. The attribute ``done`` becomes true when the analysis is over.'''
+
+    def __init__(self, criteria, alts = None, find_best = None,
+            max_dev = 2, allowed_pairs_callback = lambda x: None,
+            store = None, strategy = 'order', undo = 0):
+        self.criteria, self.alts, self.prefs = _setup(criteria, alts)
+        assert 2 <= max_dev <= 2*len(self.criteria)
+        assert strategy in ('order', 'informative')
+        self.strategy = strategy
+        if find_best:
+            assert 1 <= find_best <= len(self.alts)
+        self.find_best = find_best
+        self.allowed_pairs_callback = allowed_pairs_callback
+        self.store = store
+        prefs = self.prefs
+
+        if store is not None:
+            # Start from everything the store knows about these
+            # criteria. If some of it is contradictory, fall back to
+            # learning one answer at a time.
+            triples = store.triples(self.criteria)
+            prefs.update(x for a, b, _ in triples for x in (a, b))
+            try:
+                prefs.learn_many(triples)
+            except ContradictionError:
+                for triple in triples:
+                    try:
+                        prefs.learn(*triple)
+                    except ContradictionError:
+                        pass
+
+        if find_best:
+            prefs.update(self.alts)
+            # `n_better[x]` is the number of alternatives known to be
+            # better than `x`. Once it reaches `find_best`, `x` can't
+            # be in the requested `extreme` set, so we put it in
+            # `not_best` and stop comparing it.
+            mask = _bitset(prefs._ids[x] for x in self.alts)
+            self._n_better = {x: _popcount(mask &
+                    prefs._ups(prefs._find(prefs._ids[x])))
+                for x in self.alts}
+
+        # Each stage of the search allows a wider range of
+        # `(size1, size2)` deviations for the hypothetical items, by
+        # adding a group of them to `_sizes`. `_group` is the
+        # `(deviation, big)` of the group we added last, and
+        # `_allowed_pairs` is `_sizes` in the order to try them.
+        self.max_dev = max_dev
+        self._group = 0, 0
+        self._sizes = []
+        self._allowed_pairs = None
+
+        # Our place among the pairs of alternatives to try in this
+        # stage. See `_next_pair`. In the first stage, we scan all the
+        # pairs. After that, `_pairs` has the pairs to try, as a flat
+        # array of IDs, and `_p_ix` is the index of the next one.
+        # `_open` collects the pairs that we get to in this stage and
+        # that are still incomparable, to carry forward to the next.
+        self._a = None
+        self._a_ix = len(self.alts) - 1
+        self._later = 0
+        self._bs = []
+        self._b_ix = 0
+        self._pairs = None
+        self._p_ix = 0
+        self._open = array('I')
+
+        # The pair of alternatives `(a, b)` that we're trying to
+        # compare, and the stack of the search for hypothetical items
+        # that compare them. Each frame is a list `[rel, m1, m2, k,
+        # i1, i2]`: `rel` is the relation implied so far, `m1` and
+        # `m2` are bitsets of the criteria not yet accounted for on
+        # each side, and the rest is the index of the next
+        # `(size1, size2)` and the indices of the next combinations of
+        # criteria, as from `_subsets`.
+        self._pair = None
+        self._stack = []
+
+        # The question to ask, if any, and the bitsets of the
+        # combinations of criteria that produced it. With the
+        # informative strategy, `_step` is `None`, since the frame is
+        # left where it was, to be stepped through again once the
+        # question is answered.
+        self.question = None
+        self._step = None
+        self.done = False
+        self.n_answers = 0
+        # If we're keeping a history for `undo`, a list with an entry
+        # from `_remember` for each of the last `_max_undo` answers.
+        self._max_undo = undo
+        self._history = [] if undo else None
+
+        self._derive()
+
+    def _derive(self):
+        # Set the attributes that follow from the others, and so
+        # needn't be saved in a checkpoint.
+        prefs = self.prefs
+        if self.find_best:
+            self._alt_set = frozenset(self.alts)
+            self._not_best = {x
+                for x in self.alts
+                if self._n_better[x] >= self.find_best}
+        # The item space is already in order, and we don't want to
+        # enumerate it more than we have to. Otherwise, we order
+        # alternatives by their codes in `prefs`, which prevents us
         # from behaving differently depending on the default sort
         # order of the criterion values. (We're still sensitive to the
         # order of criteria, though.)
-        return tuple(criteria[i].index(v) for i, v in enumerate(item))
+        self._ordered = (self.alts
+            if isinstance(self.alts, _ItemSpace)
+            else sorted(self.alts,
+                key = lambda x: prefs._codes[prefs._ids[x]]))
+        # Caches for `_subsets` and `_hypothetical`.
+        self._subset_table = {}
+        self._ref = tuple(c[-1] for c in self.criteria)
+        self._hypotheticals = {}, {}
+        # The IDs of the alternatives, for the informative strategy.
+        # For the item space, we count every element.
+        self._alt_mask = (None
+            if isinstance(self.alts, _ItemSpace)
+            else _bitset(prefs._ids[x] for x in self.alts))
+        # The question that `speculate` ran ahead from and the
+        # resulting session for each answer, and, in a session that's
+        # being run ahead, the pairs that became comparable and the
+        # `stop` callback from `speculate`.
+        self._speculation = None, {}
+        self._changed = None
+        self._stop = None
+
+    def next_question(self):
+        "Return the next pair of items ``(a, b)`` to ask about, or :data:`py:None` if the analysis is done. Until it's answered with :meth:`answer`, the same question is returned again."
+        self._advance()
+        return self.question
 
-    for allowed_pairs in (l[::-1] for l in accumulate(
-           [(big, small)] + ([] if big == small else [(small, big)])
-           for deviation in range(1, max_dev)
-           for big in range(deviation, deviation // 2, -1)
-           for small in [deviation + 1 - big]
-           if small <= len(criteria))):
+    def answer(self, rel):
+        'Answer the current question with a :class:`Relation` (other than :const:`IC <Relation.IC>`) for ``a`` and ``b``.'
+        assert self.question is not None
+        self._remember(*self.question)
+        question, branches = self._speculation
+        self._speculation = None, {}
+        if question == self.question and rel in branches:
+            self._adopt(*branches[rel])
+            if self.store is not None:
+                self.store.put(self.criteria, *question, rel)
+            return
+        (a, b), self.question = self.question, None
+        self.n_answers += 1
+        self._learn(a, b, rel)
+        if self.store is not None:
+            self.store.put(self.criteria, a, b, rel)
+        if self._step is not None:
+            self._descend(*self._step, rel)
 
-        allowed_pairs_callback(allowed_pairs)
+    def next_questions(self, n):
+        """Return a list of up to ``n`` questions to ask at once. The first is the question from :meth:`next_question`. For the others, the search continues on a scratch copy of the session, as if each earlier question were never answered and its pair of alternatives were skipped, until the end of the current stage. So, each question comes from a different pair of alternatives. Answer the first question with :meth:`answer` and the rest with :meth:`tell`, in any order. The list is empty if the analysis is done."""
 
-        to_try = set(choose2(sorted(alts, key = num_item)))
+        if (first := self.next_question()) is None:
+            return []
+        self._speculation = None, {}
+        questions = [first]
+        scratch = self._scratch()
+        while len(questions) < n:
+            scratch.question = None
+            scratch._stack.clear()
+            scratch._advance(new_stage = False)
+            if scratch.question is None:
+                break
+            if (scratch.question not in questions and
+                    scratch.question[::-1] not in questions):
+                questions.append(scratch.question)
+                # The scratch copy may have made new hypothetical
+                # items for it.
+                self.prefs.update(scratch.question)
+        return questions
 
+    def tell(self, a, b, rel):
+        "As :meth:`answer`, but for a question other than the current one, such as one of the others from :meth:`next_questions`. If the answer settles the current question, it's dropped, and :meth:`next_question` moves on."
+        self._remember(a, b)
+        self.n_answers += 1
+        self._speculation = None, {}
+        self._learn(a, b, rel)
+        if self.store is not None:
+            self.store.put(self.criteria, a, b, rel)
+
+    def undo(self):
+        "Take back the last answer given with :meth:`answer` or :meth:`tell`, returning the session to just as it was before. Return false if there's nothing to take back. Only as many answers as the parameter ``undo`` can be taken back, and answers from before the session was saved with :meth:`save` can't be taken back, either. This costs time in proportion to what the answer changed, not the size of the session, using :meth:`PreorderedSet.checkpoint`. The store, if any, gets back what it had for the question before."
+        if not self._history:
+            return False
+        state, n_open, (a, b, stored) = self._history.pop()
+        self.prefs.rollback()
+        del state['_open'][n_open:]
+        self.__dict__.update(state)
+        if self.store is not None:
+            if stored is None:
+                self.store.delete(self.criteria, a, b)
+            else:
+                self.store.put(self.criteria, a, b, stored)
+        return True
+
+    def speculate(self, stop = None, pause = None):
+        """Return a generator that runs the session ahead, on scratch copies, to the next question after each possible answer to the current question, one answer per step, likeliest first. If the current question is then answered with one of those answers, :meth:`answer` takes the session from the scratch copy instead of redoing the work, even if that answer was only partly worked out. The caller can stop the generator after any step. The idea is to use the time the user spends answering. Until then, the session mustn't be changed, but the generator may be run in another thread. In that case, ``stop`` can be a callable, such as :meth:`threading.Event.is_set`, that's called as the search goes; once it returns true, the generator ends without finishing the answer it's on. ``pause`` is a callable like ``stop``, but once it returns true, the generator ends the step early, and the next step carries on where it left off. This allows time-slicing a step, as :func:`avda` does."""
+
+        if (question := self.next_question()) is None:
+            return
+        self._speculation = question, {}
+        # Guess that the item that's better on more criteria is
+        # preferred, and that ties are rare.
+        a, b = (self.prefs._levels[self.prefs._ids[x]] for x in question)
+        lead = sum(x > y for x, y in zip(a, b)) - sum(
+            x < y for x, y in zip(a, b))
+        def halt():
+            return ((stop is not None and stop()) or
+                (pause is not None and pause()))
+        for rel in ((LT, GT) if lead < 0 else (GT, LT)) + (EQ,):
+            scratch = self._scratch()
+            calls = []
+            scratch.allowed_pairs_callback = calls.append
+            scratch._changed = []
+            scratch._stop = halt
+            if self._history is not None:
+                scratch.prefs.checkpoint()
+            scratch.answer(rel)
+            # The scratch copy is left in a consistent state wherever
+            # it halts, so we keep it even before it's finished.
+            self._speculation[1][rel] = scratch, calls
+            while True:
+                scratch._advance()
+                if stop is not None and stop():
+                    return
+                finished = scratch.question is not None or scratch.done
+                yield
+                if self._speculation[0] != question:
+                    return
+                if finished:
+                    break
+
+    def ranking(self):
+        "Return a best-effort ranking of the alternatives from what's known so far, per :meth:`PreorderedSet.ranking`. Raise :class:`ValueError` if the session is over the whole item space, since ranking it would mean adding every item to ``prefs``."
+        if isinstance(self.alts, _ItemSpace):
+            raise ValueError("Can't rank the whole item space")
+        return self.prefs.ranking(self.alts)
+
+    def unresolved(self):
+        "Return a list of the pairs of alternatives that are still incomparable. As with :meth:`ranking`, raise :class:`ValueError` if the session is over the whole item space."
+        if isinstance(self.alts, _ItemSpace):
+            raise ValueError("Can't list the pairs of the whole item space")
+        # Take each alternative's incomparable ones from the bitsets,
+        # rather than comparing every pair.
+        prefs = self.prefs
+        ids = [prefs._ids[x] for x in self.alts]
+        later = _bitset(ids)
+        out = []
+        for a, i in zip(self.alts, ids):
+            later &= ~(1 << i)
+            r = prefs._find(i)
+            out.extend((a, prefs._items[j]) for j in _bits(later &
+                ~(prefs._ups(r) | prefs._downs(r) | prefs._class(r))))
+        return out
+
+    def save(self, path):
+        'Save the session to the file ``path``, in the format described in :mod:`artiruno.checkpoint`.'
+        from artiruno.checkpoint import save
+        save(self, path)
+
+    @classmethod
+    def load(cls, path, allowed_pairs_callback = lambda x: None,
+            store = None, undo = 0):
+        "Return the session saved to the file ``path`` by :meth:`save`, ready to continue where it left off. The callback, the store, and how many answers :meth:`undo` can take back aren't saved, so they can be provided again here."
+        from artiruno.checkpoint import load
+        return load(path, allowed_pairs_callback, store, undo)
+
+    def _advance(self, new_stage = True):
+        # Work until we need an answer from the user, or we're done.
+        # With `new_stage` false, stop at the end of the current stage.
+        prefs = self.prefs
+        if self.question is not None and (
+                rel := prefs.cmp(*self.question)) != IC:
+            # The question was settled by `tell`.
+            self.question = None
+            if self._step is not None:
+                self._descend(*self._step, rel)
+        while self.question is None and not self.done:
+            if self._stack:
+                self._search()
+            elif self._allowed_pairs is None:
+                self._start_stage()
+            elif self.find_best and len(prefs.extreme(
+                    self.find_best, self.alts)) >= self.find_best:
+                self.done = True
+            elif (pair := self._next_pair()) is not None:
+                self._pair = a, b = pair
+                self._hypotheticals = {}, {}
+                m = _bitset(ci
+                    for ci in range(len(self.criteria))
+                    if a[ci] != b[ci])
+                self._push(EQ, m, m)
+            elif not (new_stage and self._carry() and self._start_stage()):
+                self.done = True
+            if self._stop is not None and self._stop():
+                return
+
+    def _adopt(self, scratch, calls):
+        # Take the state of a session run ahead by `speculate`,
+        # keeping our `prefs` object, so references to it stay good,
+        # as well as its watchers, which we notify of the changes.
+        # If we're keeping a history, the scratch copy has its own
+        # checkpoint, and we append its log to ours.
+        prefs, store, callback, history = (self.prefs, self.store,
+            self.allowed_pairs_callback, self._history)
+        watchers, log, marks = prefs._watchers, prefs._log, prefs._marks
+        prefs.__dict__ = scratch.prefs.__dict__
+        prefs._watchers = watchers
+        if history is not None:
+            log.extend(prefs._log)
+            prefs._log, prefs._marks = log, marks
+        self.__dict__ = scratch.__dict__
+        self.prefs, self.store, self.allowed_pairs_callback, self._history = (
+            prefs, store, callback, history)
+        changed, self._changed = self._changed, None
+        self._stop = None
+        prefs._notify(changed)
+        for allowed_pairs in calls:
+            callback(allowed_pairs)
+
+    def _remember(self, a, b):
+        # If we're keeping a history, save what `undo` needs before
+        # an answer about `a` and `b`. `prefs` gets a checkpoint
+        # instead of a copy.
+        if self._history is None:
+            return
+        state = self.__dict__.copy()
+        del state['_history']
+        state.update(
+            _sizes = list(self._sizes),
+            _stack = [list(frame) for frame in self._stack],
+            _hypotheticals = tuple(map(dict.copy, self._hypotheticals)),
+            _speculation = (None, {}))
+        if self.find_best:
+            state.update(
+                _n_better = dict(self._n_better),
+                _not_best = set(self._not_best))
+        # `_open` only grows, so it's enough to save its length.
+        # For the store, save what it had for the question.
+        stored = (None
+            if self.store is None
+            else self.store.get(self.criteria, a, b))
+        self._history.append((state, len(self._open), (a, b, stored)))
+        self.prefs.checkpoint()
+        if len(self._history) > self._max_undo:
+            del self._history[0]
+            self.prefs._forget_oldest()
+
+    def _scratch(self):
+        # Return a copy of the session that can be run ahead without
+        # affecting this one, or calling back or writing to the store.
+        new = copy.copy(self)
+        new.prefs = self.prefs.copy()
+        new.store = None
+        new.allowed_pairs_callback = lambda x: None
+        new._sizes = list(self._sizes)
+        new._stack = [list(frame) for frame in self._stack]
+        new._bs = list(self._bs)
+        new._pairs = copy.copy(self._pairs)
+        new._open = copy.copy(self._open)
+        new._hypotheticals = tuple(map(dict.copy, self._hypotheticals))
+        new._speculation = None, {}
+        new._changed = None
+        new._history = None
+        if self.find_best:
+            new._n_better = dict(self._n_better)
+            new._not_best = set(self._not_best)
+        return new
+
+    def _start_stage(self):
+        # Move on to the next stage. Return false if there isn't one.
+        deviation, big = self._group
         while True:
+            big -= 1
+            if big <= deviation // 2:
+                deviation += 1
+                big = deviation
+            if deviation >= self.max_dev:
+                return False
+            if (small := deviation + 1 - big) <= len(self.criteria):
+                break
+        self._group = deviation, big
+        self._sizes.extend(
+            [(big, small)] + ([] if big == small else [(small, big)]))
+        self._allowed_pairs = self._sizes[::-1]
+        self.allowed_pairs_callback(self._allowed_pairs)
+        return True
+
+    def _next_pair(self):
+        # Return the next pair `(a, b)` of alternatives that's still
+        # incomparable, or `None` if there are no more in this stage.
+        prefs = self.prefs
+        find_best = self.find_best
+        while (ids := self._next_ids()) is not None:
+            if prefs._cmp_ids(*ids) != IC:
+                continue
+            self._open.extend(ids)
+            a, b = map(prefs._items.__getitem__, ids)
+            if not (find_best and (
+                    a in self._not_best or b in self._not_best)):
+                return a, b
+        return None
 
-            if find_best and len(prefs.extreme(find_best, alts)) >= find_best:
-                return prefs
-
-            # Don't ask about pairs we already know.
-            to_try = {x for x in to_try if prefs.cmp(*x) == IC}
-
-            if find_best:
-                # Don't compare alternatives that can't be in the
-                # requested `extreme` set.
-                not_best = {x
-                    for x in alts
-                    if sum(prefs.cmp(x, a) == LT for a in alts) >=
-                       find_best}
-                to_try = {(a, b)
-                    for a, b in to_try
-                    if a not in not_best and b not in not_best}
-
-            if not to_try:
-                if any(prefs.cmp(a, b) == IC for a, b in choose2(alts)):
+    def _next_ids(self):
+        # Return the IDs of the next pair to consider, or `None`.
+        if self._pairs is not None:
+            if self._p_ix >= len(self._pairs):
+                return None
+            self._p_ix += 2
+            return self._pairs[self._p_ix - 2 : self._p_ix]
+        # We're in the first stage. We go from the last `a` in
+        # `_ordered` to the first, and for each `a`, from the last `b`
+        # after it to the first. Incomparability never comes back, so
+        # we can get the candidates `_bs` for each `a` from its
+        # bitsets.
+        prefs = self.prefs
+        while self._b_ix >= len(self._bs):
+            if self._a is not None:
+                self._later |= 1 << prefs._ids[self._a]
+            if self._a_ix < 0:
+                self._a = None
+                return None
+            self._a = a = self._ordered[self._a_ix]
+            self._a_ix -= 1
+            prefs.add(a)
+            self._b_ix = 0
+            r = prefs._find(prefs._ids[a])
+            self._bs = sorted(
+                _bits(self._later & ~(prefs._ups(r) |
+                    prefs._downs(r) | prefs._class(r))),
+                key = prefs._codes.__getitem__,
+                reverse = True)
+        self._b_ix += 1
+        return prefs._ids[self._a], self._bs[self._b_ix - 1]
+
+    def _carry(self):
+        # Keep the pairs from this stage that are still incomparable,
+        # in the same order, to try in the next stage. Return false
+        # if there are none.
+        prefs = self.prefs
+        it = iter(self._open)
+        self._pairs = array('I')
+        for i, j in zip(it, it):
+            if prefs._cmp_ids(i, j) == IC:
+                self._pairs.extend((i, j))
+        self._p_ix = 0
+        self._open = array('I')
+        return bool(self._pairs)
+
+    def _push(self, rel, m1, m2):
+        # Start a new frame of the search. If there are no criteria
+        # left, we've shown that `rel` holds between the current pair.
+        if m1:
+            self._stack.append([rel, m1, m2, 0, 0, 0])
+        else:
+            self._learn(*self._pair, rel)
+            self._stack.clear()
+
+    def _search(self):
+        # Run the search until it poses a question or the stack is
+        # empty. The steps are inlined here, since there can be a lot
+        # of them.
+        prefs, stack = self.prefs, self._stack
+        cmp_ids = prefs._cmp_ids
+        table = self._subset_table
+        h1, h2 = self._hypotheticals
+        stop = self._stop
+        allowed_pairs = self._allowed_pairs
+        # In the first frame, force use of the new allowed_pairs, to
+        # save pointless iterations.
+        first_allowed_pairs = allowed_pairs[:2]
+        while stack:
+            frame = stack[-1]
+            rel, m1, m2, k, i1, i2 = frame
+            n1, n2 = _popcount(m1), _popcount(m2)
+            sizes = (first_allowed_pairs
+                if n1 == len(self.criteria)
+                else allowed_pairs)
+            # Step through this frame until we pose a question, start
+            # a new frame, or finish this one.
+            c1s = None
+            while True:
+                if c1s is None:
+                    while k < len(sizes):
+                        size1, size2 = sizes[k]
+                        if not (n1 < size1 or n2 < size2 or
+                                (n1 == size1) != (n2 == size2)):
+                            c1s = (table.get((m1, size1)) or
+                                self._subsets(m1, size1))
+                            if i1 < len(c1s):
+                                c2s = (table.get((m2, size2)) or
+                                    self._subsets(m2, size2))
+                                break
+                        k, i1, i2 = k + 1, 0, 0
+                    else:
+                        stack.pop()
+                        break
+                c1, c2 = c1s[i1], c2s[i2]
+                here = k, i1, i2
+                i2 += 1
+                if i2 == len(c2s):
+                    i1, i2 = i1 + 1, 0
+                    if i1 == len(c1s):
+                        k, i1, c1s = k + 1, 0, None
+
+                i = h1.get(c1)
+                if i is None:
+                    i = self._hypothetical(0, c1)
+                j = h2.get(c2)
+                if j is None:
+                    j = self._hypothetical(1, c2)
+                p = cmp_ids(i, j)
+                if p == IC and self.store is not None:
+                    x, y = prefs._items[i], prefs._items[j]
+                    stored = self.store.get(self.criteria, x, y)
+                    if stored is not None:
+                        try:
+                            self._learn(x, y, stored)
+                            p = stored
+                        except ContradictionError:
+                            pass
+                if p == IC:
+                    if self.strategy == 'informative':
+                        frame[3:] = here
+                        self.question = self._most_informative(
+                            m1, m2, sizes[here[0]:])
+                        self._step = None
+                    else:
+                        frame[3:] = k, i1, i2
+                        self.question = prefs._items[i], prefs._items[j]
+                        self._step = c1, c2
+                    return
+                if rel == EQ or p in (EQ, rel):
+                    frame[3:] = k, i1, i2
+                    self._push(p if rel == EQ else rel, m1 & ~c1, m2 & ~c2)
                     break
-                return prefs
+                # Check for `stop` only after a step, so each call
+                # makes progress.
+                if stop is not None and stop():
+                    frame[3:] = k, i1, i2
+                    return
 
-            a, b = max(to_try, key = lambda pair:
-                (num_item(pair[0]), num_item(pair[1])))
-            to_try.remove((a, b))
+    def _descend(self, c1, c2, p):
+        # Continue the search, having found that the hypothetical
+        # items from `c1` and `c2` have the relation `p`.
+        rel, m1, m2, *_ = self._stack[-1]
+        if rel == EQ or p in (EQ, rel):
+            self._push(p if rel == EQ else rel, m1 & ~c1, m2 & ~c2)
 
-            cs = frozenset({ci
-                for ci in range(len(criteria))
-                if a[ci] != b[ci]})
-            try:
-                async def f(rel, cs1, cs2):
-                    if not cs1:
-                        raise Jump(rel)
-                    for size1, size2 in allowed_pairs[:
-                            # In the topmost call of `f`, force use of the
-                            # new allowed_pairs, to save pointless iterations.
-                            2 if len(cs1) == len(criteria) else None]:
-                        if (len(cs1) - size1 < 0 or len(cs2) - size2 < 0 or
-                                (len(cs1) - size1 == 0) != (len(cs2) - size2 == 0)):
-                            continue
-                        for c1 in combinations(sorted(cs1), size1):
-                            for c2 in combinations(sorted(cs2), size2):
-                                p = await get_pref(dev_from_ref(c1, a), dev_from_ref(c2, b))
-                                if rel == EQ or p in (EQ, rel):
-                                    await f(rel or p, cs1.difference(c1), cs2.difference(c2))
-                await f(EQ, cs, cs)
-            except Jump as j:
-                prefs.learn(a, b, j.value)
-            except Abort:
-                return prefs
-
-    return prefs
-
-# Define `vda` as a a synchronous version of `avda`.
-exec(
-  re.sub(r'\basync ', '',
-  re.sub(r'\bawait ', '',
-  re.sub('def avda', 'def vda',
-  ''.join(inspect.getsourcelines(avda)[0])))))
-avda.__doc__ = avda_doc
+    def _most_informative(self, m1, m2, sizes):
+        # Return the question to ask for the informative strategy,
+        # from among the steps of the current frame with the given
+        # `sizes`. Ties go to the earliest. Each answer is tried under
+        # a checkpoint of `prefs`, and rolled back.
+        prefs = self.prefs
+        items = prefs._items
+        before = self._n_comparable()
+        best, best_score = None, -1
+        for size1, size2 in sizes:
+            n1, n2 = _popcount(m1), _popcount(m2)
+            if n1 < size1 or n2 < size2 or (n1 == size1) != (n2 == size2):
+                continue
+            for c1 in self._subsets(m1, size1):
+                for c2 in self._subsets(m2, size2):
+                    i = self._hypothetical(0, c1)
+                    j = self._hypothetical(1, c2)
+                    if prefs._cmp_ids(i, j) != IC:
+                        continue
+                    score = 0
+                    for rel in (LT, EQ, GT):
+                        prefs.checkpoint()
+                        try:
+                            prefs._learn(items[i], items[j], rel)
+                            score += self._n_comparable() - before
+                        finally:
+                            prefs.rollback()
+                    if score > best_score:
+                        best, best_score = (items[i], items[j]), score
+        return best
+
+    def _n_comparable(self):
+        # Count the ordered pairs of alternatives that are comparable
+        # in `prefs`, including each alternative with itself.
+        prefs = self.prefs
+        mask = self._alt_mask
+        if mask is None:
+            mask = (1 << len(prefs._items)) - 1
+        return sum(
+            _popcount(mask & (prefs._ups(r) | prefs._downs(r) | prefs._class(r)))
+            for i in _bits(mask)
+            for r in [prefs._find(i)])
+
+    def _subsets(self, m, size):
+        # Return a tuple of the bitsets of each combination of `size`
+        # criteria from the bitset `m`, in the order of
+        # `combinations`.
+        if (m, size) not in self._subset_table:
+            self._subset_table[m, size] = tuple(
+                _bitset(c) for c in combinations(_bits(m), size))
+        return self._subset_table[m, size]
+
+    def _hypothetical(self, side, c):
+        # Return the ID in `prefs` of the hypothetical item that
+        # deviates from the best possible item on the criteria in the
+        # bitset `c`, taking those values from `_pair[side]`.
+        cache = self._hypotheticals[side]
+        if (i := cache.get(c)) is None:
+            item = list(self._ref)
+            vector = self._pair[side]
+            for ci in _bits(c):
+                item[ci] = vector[ci]
+            item = tuple(item)
+            self.prefs.add(item)
+            i = cache[c] = self.prefs._ids[item]
+        return i
+
+    def _learn(self, a, b, rel):
+        # Call `prefs.learn`, and update `_n_better` from the pairs
+        # that changed.
+        changed = self.prefs.learn(a, b, rel)
+        if self._changed is not None:
+            self._changed.extend(changed)
+        if self.find_best:
+            for x, y in changed:
+                if x in self._alt_set and y in self._alt_set:
+                    r = self.prefs.cmp(x, y)
+                    if r != EQ:
+                        worse = x if r == LT else y
+                        self._n_better[worse] += 1
+                        if self._n_better[worse] >= self.find_best:
+                            self._not_best.add(worse)
 
 def _setup(criteria, alts = None, find_best = None):
     # Some initial VDA logic put into its own function so it can be
@@ -138,7 +805,7 @@ def _setup(criteria, alts = None, find_best = None):
         for c in criteria)
 
     if alts is None:
-        alts = tuple(product(*criteria))
+        alts = _ItemSpace(criteria)
     else:
         alts = tuple(map(tuple, alts))
         assert all(
@@ -151,23 +818,36 @@ def _setup(criteria, alts = None, find_best = None):
     # Define the user's preferences as a preorder, with `a < b` if `b`
     # is preferred to `a`, and `a` and `b` incomparable if the user's
     # preference isn't yet known.
-    prefs = PreorderedSet()
-    add_items(criteria, prefs, alts)
+    prefs = (DominancePreorderedSet(criteria, implicit = True)
+        if isinstance(alts, _ItemSpace)
+        else DominancePreorderedSet(criteria, alts))
 
     return criteria, alts, prefs
 
-def add_items(criteria, prefs, items):
-    # Enforce the assumption that on any single criterion, bigger
-    # values are better.
-    for x in set(items) - prefs.elements:
-        prefs.add(x)
-        for a in prefs.elements - {x}:
-            cmps = [
-                Relation.cmp(
-                    criteria[ci].index(x[ci]),
-                    criteria[ci].index(a[ci]))
-                for ci in range(len(criteria))]
-            if not (LT in cmps and GT in cmps):
-                # One item dominates the other. (We know that `cmps`
-                # isn't all EQ because `x` and `a` are different.)
-                prefs.learn(x, a, LT if LT in cmps else GT)
+class _ItemSpace(Sequence):
+    # All the items for `criteria`, as a read-only sequence in the
+    # order of `product`, which is also the order of the items' codes
+    # in `DominancePreorderedSet`. Items are only made when asked for.
+
+    def __init__(self, criteria):
+        self.criteria = criteria
+
+    def __len__(self):
+        return prod(map(len, self.criteria))
+
+    def __getitem__(self, i):
+        i = range(len(self))[i]
+        if isinstance(i, range):
+            return tuple(map(self.__getitem__, i))
+        item = []
+        for c in reversed(self.criteria):
+            i, k = divmod(i, len(c))
+            item.append(c[k])
+        return tuple(reversed(item))
+
+    def __iter__(self):
+        return product(*self.criteria)
+
+    def __contains__(self, x):
+        return len(x) == len(self.criteria) and all(
+            v in c for v, c in zip(x, self.criteria))
@@ -2,8 +2,9 @@
 
 import asyncio, traceback
 import js, pyodide
-from artiruno.vda import avda
-from artiruno.interactive import setup_interactive, results_text
+from artiruno.vda import avda, Undo
+from artiruno.interactive import (
+    setup_interactive, results_text, UNDO_STEPS)
 from artiruno.preorder import LT, GT, EQ
 
 # ------------------------------------------------------------
@@ -124,6 +125,7 @@ async def _restart_decision_making(scenario):
 async def interact(criterion_names, epoch, **kwargs):
     kwargs.pop('alt_names', None)
     questions = []
+    answered = []
 
     async def asker(a, b):
         # Present the choices as a list with buttons.
@@ -145,7 +147,7 @@ async def interact(criterion_names, epoch, **kwargs):
                 for i, (name, value)
                 in enumerate(zip(criterion_names, item))))
 
-        E('dm').appendChild(H.DIV(
+        query = H.DIV(
             H.P(T('Q{}: Which would you prefer?'.format(
                 len(questions) + 1))),
             H.UL(
@@ -154,8 +156,12 @@ async def interact(criterion_names, epoch, **kwargs):
                 H.LI(button('option_b', 'Option B'),
                     display_item(b)),
                 H.LI(button('equal', 'Equal'),
-                    T('The two options are equally preferable'))),
-            Class = 'query'))
+                    T('The two options are equally preferable')),
+                *([H.LI(button('undo', 'Undo'),
+                        T('Take back the previous answer'))]
+                    if answered else [])),
+            Class = 'query')
+        E('dm').appendChild(query)
 
         for button, callback in buttons.items():
             E(button).addEventListener('click', callback)
@@ -163,6 +169,15 @@ async def interact(criterion_names, epoch, **kwargs):
         # Wait for the user to click a button.
         time_onset = js.performance.now() - epoch
         choice = await get_signal('choice')
+        if choice == 'undo':
+            # Remove this question and the previous one, which will
+            # be asked again.
+            for callback in buttons.values():
+                callback.destroy()
+            query.remove()
+            answered.pop().remove()
+            questions.pop()
+            raise Undo()
         questions.append(dict(
             a = a, b = b, choice = choice,
             time_onset = time_onset,
@@ -172,15 +187,22 @@ async def interact(criterion_names, epoch, **kwargs):
 
         # Replace the buttons with indicators of the user's decision.
         for button, callback in buttons.items():
-            E(button).replaceWith(H.SPAN(
-               T('your choice' if button == choice else 'not chosen'),
-               Class = 'chosen' if button == choice else 'not-chosen'))
+            if button == 'undo':
+                E(button).parentNode.remove()
+            else:
+                E(button).replaceWith(H.SPAN(
+                   T('your choice' if button == choice else 'not chosen'),
+                   Class = 'chosen' if button == choice else 'not-chosen'))
             callback.destroy()
+        answered.append(query)
+        if len(answered) > UNDO_STEPS:
+            del answered[0]
 
         # Return the choice.
         return dict(option_a = GT, option_b = LT, equal = EQ)[choice]
 
-    prefs = await avda(asker = asker, **kwargs)
+    prefs = await avda(asker = asker, speculate = True, undo = UNDO_STEPS,
+        **kwargs)
     return prefs, questions
 
 async def stop_web_vda():
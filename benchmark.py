@@ -0,0 +1,111 @@
+# Time VDA on a few fixed scenarios with simulated users, to check
+# the performance of the question search. Each user answers according
+# to a weighted sum of criterion levels. The number of questions is
+# printed along with the time, so changes that should only affect
+# speed can be checked for changing the questions, too.
+#
+# Usage: python3 benchmark.py [NAME ...]
+# where each NAME is one of the scenarios below (default: all of them).
+#
+# Or: python3 benchmark.py --simulate [TRIALS]
+# to compare the question-selection strategies (the `strategy` of
+# `vda`) on random scenarios like those of `random_scenarios` in the
+# tests, reporting the mean and maximum numbers of questions for each
+# strategy, and the total time. So far, the informative strategy has
+# given the same counts, or slightly more for 3x3x3, at 2 to 3 times
+# the time, even when it chose among all the open pairs of a stage.
+
+import sys, json, time, random, itertools
+from pathlib import Path
+import artiruno
+
+def value_asker(criteria, weights):
+    def value(item):
+        return sum(w * c.index(v)
+            for w, c, v in zip(weights, criteria, item))
+    def asker(a, b):
+        asker.n += 1
+        return artiruno.Relation.cmp(value(a), value(b))
+    asker.n = 0
+    return asker
+
+def example(name, find_best = None):
+    scenario = json.loads(
+        (Path(__file__).parent / 'examples' / f'{name}.json').read_text())
+    criteria = [tuple(c) for c in scenario['criteria'].values()]
+    alts = scenario.get('alts')
+    if isinstance(alts, dict):
+        alts = alts.values()
+    alts = alts and [tuple(a[c] for c in scenario['criteria'])
+        for a in alts]
+    return dict(criteria = criteria, alts = alts,
+        find_best = find_best or scenario.get('find_best'),
+        max_dev = 2 * len(criteria))
+
+scenarios = dict(
+    space_4x4 = dict(criteria = [range(4)] * 4, max_dev = 8),
+    space_3x5 = dict(criteria = [range(3)] * 5, max_dev = 4),
+    jobs = example('jobs'),
+    faculty = example('faculty'),
+    birds = example('birds'))
+
+def lexicographic_asker(criteria, R):
+    order = R.sample(range(len(criteria)), len(criteria))
+    return lambda a, b: artiruno.Relation.cmp(*(
+        tuple(v[i] for i in order)
+        for v in (a, b)))
+
+def additive_asker(criteria, R):
+    values = [[0] + [R.randint(1, 4) for _ in c[1:]] for c in criteria]
+    return lambda a, b: artiruno.Relation.cmp(*(
+        sum(sum(values[ci][: cl + 1]) for ci, cl in enumerate(item))
+        for item in (a, b)))
+
+def simulate(trials):
+    strategies = ('order', 'informative')
+    print('{:10} {:14}'.format('criteria', 'asker') + ''.join(
+        '{:>27}'.format(s + ' mean/max/time') for s in strategies))
+    for shape in [(2,2), (3,4), (5,5), (2,2,2), (3,2,2), (3,3,3)]:
+        criteria = tuple(tuple(range(n)) for n in shape)
+        item_space = tuple(itertools.product(*criteria))
+        for make_asker in (lexicographic_asker, additive_asker):
+            counts = {s: [] for s in strategies}
+            times = dict.fromkeys(strategies, 0)
+            for trial in range(trials):
+                R = random.Random(repr((criteria, trial)))
+                alts = R.sample(item_space,
+                    min(len(item_space), R.randint(2, 8)))
+                asker = make_asker(criteria, R)
+                for strategy in strategies:
+                    n = 0
+                    def counting_asker(a, b):
+                        nonlocal n
+                        n += 1
+                        return asker(a, b)
+                    start = time.perf_counter()
+                    artiruno.vda(criteria, alts, counting_asker,
+                        max_dev = 2 * len(criteria), strategy = strategy)
+                    times[strategy] += time.perf_counter() - start
+                    counts[strategy].append(n)
+            print('{:10} {:14}'.format(
+                    'x'.join(map(str, shape)),
+                    make_asker.__name__.split('_')[0]) +
+                ''.join('{:14.2f}{:6d}{:7.2f}'.format(
+                        sum(counts[s]) / trials, max(counts[s]), times[s])
+                    for s in strategies))
+
+def main(names):
+    for name in names or scenarios:
+        kwargs = scenarios[name]
+        criteria = [tuple(c) for c in kwargs['criteria']]
+        asker = value_asker(criteria, [3**i for i in range(len(criteria))])
+        start = time.perf_counter()
+        artiruno.vda(asker = asker, **kwargs)
+        print('{:12} {:5d} questions {:8.3f} s'.format(
+            name, asker.n, time.perf_counter() - start))
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--simulate']:
+        simulate(int(sys.argv[2]) if len(sys.argv) > 2 else 100)
+    else:
+        main(sys.argv[1:])
@@ -88,6 +88,15 @@ def test_extrema():
     assert x.extreme(n = 2) == {2, 3}
     assert x.extreme(n = 3) == {1, 2, 3}
 
+def test_ranking():
+    x = PreorderedSet(range(6))
+    x.learn(0, 1, LT)
+    x.learn(1, 2, LT)
+    x.learn(3, 2, LT)
+    x.learn(4, 5, EQ)
+    assert x.ranking() == [{2, 4, 5}, {1, 3}, {0}]
+    assert x.ranking(among = {0, 1, 3}) == [{1, 3}, {0}]
+
 def test_extreme_n():
     x = PreorderedSet(l + str(i)
         for l in "wxyz"
@@ -127,6 +136,10 @@ def test_add():
     x.learn('f', 'a', LT)
     assert x.cmp('f', 'a') == LT
     assert x.cmp('f', 'z') == LT
+    x.update('gfh')
+    assert x.elements == set('afghz')
+    assert x.cmp('g', 'h') == x.cmp('g', 'a') == IC
+    assert x.cmp('f', 'z') == LT
 
 def test_learn_return_value():
     x = PreorderedSet((1, 2, 3))
@@ -134,6 +147,105 @@ def test_learn_return_value():
     assert x.learn(2, 3, LT) == [(2, 3), (1, 3)]
     assert x.learn(1, 2, LT) == []
 
+def test_eq_classes():
+    x = PreorderedSet(range(6), [(0, 1, EQ), (2, 3, EQ), (4, 5, LT)])
+    assert sorted(x.learn(3, 0, EQ)) == [(0, 2), (0, 3), (1, 2), (1, 3)]
+    assert sorted(x.learn(5, 2, LT)) == [
+        (0, 4), (0, 5), (1, 4), (1, 5), (2, 4), (2, 5), (3, 4), (3, 5)]
+    assert x.summary() == "0=1 0=2 0=3 1=2 1=3 2=3 4<0 4<1 4<2 4<3 4<5 5<0 5<1 5<2 5<3"
+    with pytest.raises(ContradictionError):
+        x.learn(1, 4, EQ)
+
+def test_ancestors():
+    x = PreorderedSet("abcde", [("a", "b", LT), ("b", "c", EQ), ("c", "d", LT)])
+    assert x.ancestors("a") == {"b", "c", "d"}
+    assert x.ancestors("b") == x.ancestors("c") == {"d"}
+    assert x.descendants("d") == {"a", "b", "c"}
+    assert x.descendants("c") == {"a"}
+    assert x.ancestors("e") == x.descendants("e") == set()
+
+def test_incomparable_pairs():
+    x = PreorderedSet("abcd", [("a", "b", LT)])
+    pairs = x.incomparable_pairs(choose2("dcba"))
+    assert pairs == {
+        ("d", "c"), ("d", "a"), ("d", "b"), ("c", "b"), ("c", "a")}
+    x.learn("b", "c", LT)
+    assert pairs == {("d", "c"), ("d", "a"), ("d", "b")}
+    y = x.copy()
+    y.learn("c", "d", EQ)
+    assert len(pairs) == 3
+    x.learn("d", "a", GT)
+    assert pairs == {("d", "c"), ("d", "b")}
+
+def test_learn_many():
+    x = PreorderedSet("abcde")
+    pairs = x.incomparable_pairs(choose2("abcde"))
+    assert x.learn_many([("a", "b", LT), ("b", "c", LT), ("a", "c", LT)]) == [
+        ("a", "b"), ("b", "c"), ("a", "c")]
+    assert pairs == {("a", "d"), ("a", "e"), ("b", "d"), ("b", "e"),
+        ("c", "d"), ("c", "e"), ("d", "e")}
+    # A contradiction undoes the whole batch.
+    with pytest.raises(ContradictionError):
+        x.learn_many([("d", "e", EQ), ("c", "d", LT), ("e", "a", LT)])
+    assert x.summary() == "a<b a<c b<c"
+    assert len(pairs) == 7
+    # So does any other error, such as an unknown element.
+    with pytest.raises(KeyError):
+        x.learn_many([("d", "e", EQ), ("a", "zz", LT)])
+    assert x.summary() == "a<b a<c b<c"
+    assert not x._marks and x._log is None
+    assert x.learn_many([("d", "e", EQ), ("c", "d", LT)])
+    assert x.summary() == "a<b a<c a<d a<e b<c b<d b<e c<d c<e d=e"
+    assert not pairs
+
+def test_rollback():
+    x = PreorderedSet(range(4))
+    x.learn(0, 1, LT)
+    before = x.relations
+    live = x.incomparable_pairs(choose2(range(4)))
+    def inner():
+        x.checkpoint()
+        x.update((4, 5))
+        x.learn(2, 4, EQ)
+        x.learn(3, 5, GT)
+        x.learn(5, 4, GT)
+
+    x.checkpoint()
+    x.learn(1, 2, LT)
+    inner()
+    after = x.relations
+    x.rollback()
+    assert x.elements == set(range(4))
+    assert x.cmp(0, 2) == LT and x.cmp(0, 3) == IC
+
+    # Rolling back the outer checkpoint also undoes the inner one,
+    # even if the inner one was committed.
+    inner()
+    assert x.relations == after
+    x.commit()
+    x.rollback()
+    assert x.relations == before
+    assert live == {(a, b) for a, b in choose2(range(4)) if x.cmp(a, b) == IC}
+
+def test_merge():
+    x = PreorderedSet("abc", [("a", "b", LT)])
+    y = PreorderedSet("bcd", [("b", "c", EQ), ("d", "c", GT)])
+    assert sorted(x.merge(y)) == [
+        ("a", "c"), ("a", "d"), ("b", "c"), ("b", "d"), ("c", "d")]
+    assert x.summary() == "a<b a<c a<d b=c b<d c<d"
+    with pytest.raises(ContradictionError):
+        x.merge(PreorderedSet("abz", [("a", "b", GT)]))
+    assert "z" not in x.elements
+    assert x.summary() == "a<b a<c a<d b=c b<d c<d"
+
+def test_sparse():
+    'Unknown relations should take no space.'
+    x = PreorderedSet(range(1000))
+    x.learn(998, 999, LT)
+    x.learn(5, 7, EQ)
+    assert x.summary() == "5=7 998<999"
+    assert x.get_subset({5, 7, 999}).summary() == "5=7"
+
 
 def graph_example():
     x = test_complex()
@@ -1,9 +1,20 @@
 import random, itertools, inspect, asyncio
+from itertools import product
 from collections import Counter
 import artiruno
 from artiruno import Relation, IC, LT, EQ, GT, vda, avda, cmp, choose2
 import pytest
 
+def test_import():
+    'Importing the package should stay cheap.'
+    import subprocess, sys
+    loaded = subprocess.run(
+        [sys.executable, '-c', 'import sys, artiruno; print(*sys.modules)'],
+        capture_output = True, text = True, check = True).stdout.split()
+    for name in ('inspect', 'platform', 'json', 'artiruno.interactive'):
+        assert name not in loaded
+    assert artiruno.m.interactive.interact
+
 def test_assumptions():
     '''Test the preferences that we should assume purely from the
     criteria definitions, without having asked the user anything
@@ -22,6 +33,60 @@ def test_assumptions():
         alts = ((1, 1, 1), (2, 1, 2)))
     assert prefs.cmp((1, 1, 1), (2, 1, 2)) == LT
 
+def test_dominance_preorder():
+    criteria = [range(3)] * 3
+    P = artiruno.DominancePreorderedSet
+    x = P(criteria, [(0, 0, 0), (2, 0, 0), (0, 2, 0), (1, 1, 1)])
+    assert x.cmp((0, 0, 0), (1, 1, 1)) == LT
+    assert x.cmp((2, 0, 0), (0, 2, 0)) == IC
+    assert x.summary() == "(0, 0, 0)<(0, 2, 0) (0, 0, 0)<(1, 1, 1) (0, 0, 0)<(2, 0, 0)"
+    assert x.learn((2, 0, 0), (0, 2, 0), GT) == [((0, 2, 0), (2, 0, 0))]
+    # New items should pick up the consequences of learned relations.
+    x.add((0, 1, 0))
+    x.add((2, 1, 0))
+    assert x.cmp((0, 1, 0), (2, 0, 0)) == LT
+    assert x.cmp((0, 2, 0), (2, 1, 0)) == LT
+    assert x.cmp((0, 1, 0), (1, 1, 1)) == LT
+    assert x.cmp((2, 0, 0), (1, 1, 1)) == IC
+    assert x.get_subset({(0, 1, 0), (2, 1, 0), (2, 0, 0)}).summary() == (
+        "(0, 1, 0)<(2, 0, 0) (0, 1, 0)<(2, 1, 0) (2, 0, 0)<(2, 1, 0)")
+    with pytest.raises(artiruno.ContradictionError):
+        x.learn((0, 1, 0), (2, 1, 0), EQ)
+
+def test_dominance_index():
+    criteria = [range(3), range(2), range(4)]
+    items = list(product(*criteria))
+    random.seed(9)
+    random.shuffle(items)
+    bulk = artiruno.DominancePreorderedSet(criteria, items)
+    one = artiruno.DominancePreorderedSet(criteria)
+    for x in items:
+        if x == (2, 1, 3):
+            before = one.copy()
+        one.add(x)
+    def above(x, among):
+        return {y for y in among
+            if y != x and all(a <= b for a, b in zip(x, y))}
+    for x in items:
+        assert bulk.ancestors(x) == one.ancestors(x) == above(x, items)
+    # Item codes should sort like the criterion levels.
+    assert sorted(items, key = lambda x: one._codes[one._ids[x]]) == (
+        sorted(items))
+    # Copies shouldn't share the index.
+    for x in before.elements:
+        assert before.ancestors(x) == above(x, before.elements)
+
+def test_item_space():
+    criteria = [range(4)] * 8
+    _, alts, prefs = artiruno.m.vda._setup(criteria)
+    # Nothing should be enumerated up front.
+    assert len(alts) == 4**8 and not prefs.elements
+    assert list(alts[:3]) == list(itertools.islice(alts, 3))
+    assert alts[-1] == (3,) * 8 and alts[4] == (0,) * 6 + (1, 0)
+    assert (0,) * 7 + (4,) not in alts
+    assert prefs.cmp((0,) * 8, (1,) * 8) == LT
+    assert len(prefs.elements) == 2
+
 def test_appendixD():
     '''Appendix D of Larichev and Moshkovich (1995).'''
 
@@ -120,9 +185,350 @@ async def test_async():
     assert (await f()).maxes(alts) == {(1, 0)}
     assert l == ['start', 'in other', 'done']
 
+async def test_abort():
+    criteria = [range(3)] * 3
+    asked = []
+    def asker(a, b):
+        if len(asked) == 2:
+            raise artiruno.m.vda.Abort()
+        asked.append((a, b))
+        return Relation.cmp(sum(a), sum(b))
+    async def aasker(a, b):
+        return asker(a, b)
+    prefs = vda(criteria, asker = asker)
+    learned = prefs.relations
+    assert all(learned[min(q), max(q)] != IC for q in asked)
+    asked.clear()
+    assert (await avda(criteria, asker = aasker)).relations == learned
+
+def weighted_scenario(n_alts, weights = (1, 2, 1)):
+    """Return criteria, the first `n_alts` of a fixed list of
+    alternatives, and an asker that prefers the greater weighted sum
+    of criterion levels. This is for tests of how a session is run,
+    rather than of what the search concludes."""
+    criteria = [range(3)] * 3
+    alts = [(0, 2, 1), (1, 1, 1), (2, 0, 2), (1, 2, 0), (2, 2, 0), (0, 1, 2)]
+    def asker(a, b):
+        return Relation.cmp(*(
+            sum(w * v for w, v in zip(weights, x))
+            for x in (a, b)))
+    return criteria, alts[:n_alts], asker
+
+async def test_batch():
+    "Asking several questions at once should save time with a slow asker, and reach the same conclusions."
+
+    import time
+    criteria, alts, asker = weighted_scenario(6, (1, 2, 4))
+    async def slow_asker(a, b):
+        await asyncio.sleep(.05)
+        return asker(a, b)
+
+    seconds = {}
+    for batch in (1, 4):
+        start = time.monotonic()
+        prefs = await avda(criteria, alts, slow_asker, max_dev = 6,
+            batch = batch)
+        seconds[batch] = time.monotonic() - start
+        for a, b in choose2(alts):
+            assert prefs.cmp(a, b) == asker(a, b)
+    assert seconds[4] < .75 * seconds[1]
+
+async def test_speculate():
+    "Running ahead while the user answers shouldn't change anything."
+
+    criteria, alts, asker = weighted_scenario(6, (1, 2, 4))
+
+    def run(steps, stop_after = None, pause_every = None):
+        calls = []
+        engine = artiruno.Engine(criteria, alts, max_dev = 6,
+            allowed_pairs_callback = calls.append)
+        prefs = engine.prefs
+        live = prefs.incomparable_pairs(choose2(alts))
+        asked = []
+        while (q := engine.next_question()) is not None:
+            ticks = itertools.count()
+            stop = stop_after and (lambda: next(ticks) >= stop_after)
+            pause = pause_every and (lambda: next(ticks) % pause_every == 0)
+            for _ in itertools.islice(engine.speculate(stop, pause), steps):
+                pass
+            asked.append(q)
+            engine.answer(asker(*q))
+        assert engine.prefs is prefs
+        assert live == {(a, b)
+            for a, b in choose2(alts)
+            if prefs.cmp(a, b) == IC}
+        return asked, calls, prefs.relations
+    expected = run(0)
+    assert run(1) == run(3) == expected
+    # Stopping in the middle of running ahead should be harmless, too.
+    assert run(3, stop_after = 1) == run(3, stop_after = 4) == expected
+    # So should pausing, whether or not the paused answers are taken
+    # up again before the real answer arrives.
+    assert (run(2, pause_every = 3) == run(100, pause_every = 3) ==
+        expected)
+
+    asked = []
+    async def slow_asker(a, b):
+        asked.append((a, b))
+        await asyncio.sleep(.01)
+        return asker(a, b)
+    prefs = await avda(criteria, alts, slow_asker, max_dev = 6,
+        speculate = True)
+    assert (asked, prefs.relations) == (expected[0], expected[2])
+
+def test_undo():
+    criteria, alts, asker = weighted_scenario(6)
+    expected = vda(criteria, alts, asker, max_dev = 6).relations
+
+    # Answer wrongly, then take it back, sometimes with the answer
+    # already worked out by `speculate`.
+    engine = artiruno.Engine(criteria, alts, max_dev = 6, undo = 1)
+    assert not engine.undo()
+    for i in itertools.count():
+        if (q := engine.next_question()) is None:
+            break
+        before = engine.prefs.relations, engine.n_answers
+        if i % 2:
+            for _ in engine.speculate():
+                pass
+        engine.answer(-asker(*q) or GT)
+        engine.next_question()
+        assert engine.undo()
+        assert engine.next_question() == q
+        assert (engine.prefs.relations, engine.n_answers) == before
+        engine.answer(asker(*q))
+    assert engine.prefs.relations == expected
+
+    # The same, through `vda`.
+    undone = set()
+    def undoing_asker(a, b):
+        if (a, b) not in undone:
+            undone.add((a, b))
+            raise artiruno.m.vda.Undo()
+        return asker(a, b)
+    assert vda(criteria, alts, undoing_asker, max_dev = 6,
+        undo = 1).relations == expected
+
+    # Only the last `undo` answers can be taken back, and the record
+    # of older ones is dropped.
+    engine = artiruno.Engine(criteria, alts, max_dev = 6, undo = 2)
+    states = []
+    for _ in range(4):
+        q = engine.next_question()
+        states.append(engine.prefs.relations)
+        engine.answer(asker(*q))
+    assert len(engine.prefs._marks) == 2
+    assert engine.undo() and engine.undo() and not engine.undo()
+    assert engine.prefs.relations == states[2]
+    while (q := engine.next_question()) is not None:
+        engine.answer(asker(*q))
+    assert engine.prefs.relations == expected
+
+    # Undoing an answer takes it out of the store, too, so it isn't
+    # applied again without asking.
+    from artiruno.store import AnswerStore
+    store = AnswerStore(':memory:')
+    engine = artiruno.Engine(criteria, alts, max_dev = 6, store = store,
+        undo = 5)
+    q1 = engine.next_question()
+    engine.answer(asker(*q1))
+    q2 = engine.next_question()
+    engine.answer(-asker(*q2) or GT)
+    assert engine.undo() and engine.undo()
+    assert store.get(criteria, *q1) is None
+    assert store.get(criteria, *q2) is None
+    assert engine.next_question() == q1
+    engine.answer(asker(*q1))
+    assert engine.next_question() == q2
+    assert store.get(criteria, *q1) == asker(*q1)
+
 def asker_stub(a, b):
     raise ValueError
 
+async def test_budget():
+    criteria, alts, asker = weighted_scenario(5)
+    asked = []
+    def logging_asker(a, b):
+        asked.append((a, b))
+        return asker(a, b)
+
+    prefs = vda(criteria, alts, logging_asker, max_questions = 2)
+    assert len(asked) == 2
+    unresolved = prefs.incomparable_pairs(choose2(alts))
+    assert unresolved
+    ranking = prefs.ranking(alts)
+    assert sorted(x for level in ranking for x in level) == sorted(alts)
+    for (i, l1), (j, l2) in choose2(enumerate(ranking)):
+        for a in l1:
+            for b in l2:
+                assert prefs.cmp(a, b) in (GT, IC)
+
+    engine = artiruno.Engine(criteria, alts)
+    for _ in range(2):
+        engine.answer(asker(*engine.next_question()))
+    assert engine.ranking() == ranking
+    assert set(engine.unresolved()) == unresolved
+    with pytest.raises(ValueError):
+        artiruno.Engine(criteria).unresolved()
+
+    assert vda(criteria, alts, asker_stub, deadline = 0).relations == (
+        artiruno.Engine(criteria, alts).prefs.relations)
+
+    async def slow_asker(a, b):
+        await asyncio.sleep(10)
+    prefs = await avda(criteria, alts, slow_asker, deadline = .01)
+    assert prefs.incomparable_pairs(choose2(alts))
+
+def test_engine():
+    criteria, alts, asker = weighted_scenario(4)
+    def logging_asker(a, b):
+        asked.append((a, b))
+        return asker(a, b)
+
+    asked = []
+    prefs = vda(criteria, alts, logging_asker)
+    via_vda = asked
+
+    asked = []
+    engine = artiruno.Engine(criteria, alts)
+    while (q := engine.next_question()) is not None:
+        assert engine.next_question() == q
+        engine.answer(logging_asker(*q))
+    assert asked == via_vda
+    assert engine.done and engine.next_question() is None
+    assert engine.prefs.relations == prefs.relations
+
+def test_informative():
+    "The informative strategy should reach the same conclusions, and leave no checkpoint open in the preferences."
+
+    criteria = [range(3)] * 3
+    for trial in range(10):
+        R = random.Random(trial)
+        alts = R.sample(list(product(*criteria)), 6)
+        weights = [R.randint(1, 4) for _ in criteria]
+        def asker(a, b):
+            return Relation.cmp(*(
+                sum(w * v for w, v in zip(weights, x))
+                for x in (a, b)))
+        prefs = vda(criteria, alts, asker, max_dev = 6,
+            strategy = 'informative')
+        for a, b in choose2(alts):
+            assert prefs.cmp(a, b) == asker(a, b)
+        assert prefs._log is None and not prefs._marks
+
+def test_carried_pairs():
+    "A new stage should start only while some pairs of alternatives are incomparable, and carrying them forward shouldn't change the questions."
+
+    criteria = [range(3)] * 3
+    alts = list(product(*criteria))
+    def asker(a, b):
+        return Relation.cmp(*(
+            sum(w * v for w, v in zip((1, 2, 4), x))
+            for x in (a, b)))
+    stages = []
+    def callback(allowed_pairs):
+        stages.append((list(allowed_pairs), len(asked),
+            set(engine.unresolved())))
+
+    asked = []
+    engine = artiruno.Engine(criteria, alts, max_dev = 6,
+        allowed_pairs_callback = callback)
+    while (q := engine.next_question()) is not None:
+        asked.append(q)
+        engine.answer(asker(*q))
+    assert not engine.unresolved()
+    for (_, _, open1), (_, _, open2) in zip(stages, stages[1:]):
+        assert open2 and open2 <= open1
+    # These are the stages and questions from before the pairs were
+    # carried forward, when each stage scanned all the pairs again.
+    assert [(pairs, n) for pairs, n, _ in stages] == [
+        ([(1, 1)], 0),
+        ([(1, 2), (2, 1), (1, 1)], 6),
+        ([(1, 3), (3, 1), (1, 2), (2, 1), (1, 1)], 10),
+        ([(2, 2), (1, 3), (3, 1), (1, 2), (2, 1), (1, 1)], 10)]
+    assert asked == [
+        ((2, 1, 2), (2, 2, 1)), ((2, 0, 2), (2, 2, 1)),
+        ((1, 2, 2), (2, 2, 1)), ((1, 2, 2), (2, 1, 2)),
+        ((0, 2, 2), (2, 2, 1)), ((0, 2, 2), (2, 1, 2)),
+        ((2, 2, 0), (2, 1, 1)), ((2, 2, 0), (2, 0, 1)),
+        ((1, 1, 2), (2, 2, 1)), ((0, 1, 2), (2, 2, 1))]
+
+def test_checkpoint(tmp_path):
+    "Saving and loading an `Engine` midway shouldn't change anything."
+
+    criteria, alts, asker = weighted_scenario(4)
+    path = str(tmp_path / 'session')
+
+    for kwargs in (dict(alts = alts), dict(alts = alts, find_best = 1), {},
+            dict(alts = alts, strategy = 'informative')):
+        engine = artiruno.Engine(criteria, **kwargs)
+        expected = []
+        while (q := engine.next_question()) is not None:
+            expected.append(q)
+            engine.answer(asker(*q))
+        for stop in range(len(expected) + 1):
+            engine = artiruno.Engine(criteria, **kwargs)
+            asked = []
+            for _ in range(stop):
+                asked.append(engine.next_question())
+                engine.answer(asker(*asked[-1]))
+            if stop % 2:
+                # Save with a question pending.
+                engine.next_question()
+            engine.save(path)
+            engine = artiruno.Engine.load(path)
+            assert engine.n_answers == stop
+            while (q := engine.next_question()) is not None:
+                asked.append(q)
+                engine.answer(asker(*q))
+            assert asked == expected
+
+    # A file that was cut short anywhere is rejected, rather than
+    # loaded with missing state.
+    with open(path, 'rb') as o:
+        data = o.read()
+    for cut in (3, 12, 30, len(data) // 2, len(data) - 3):
+        with open(path, 'wb') as o:
+            o.write(data[:cut])
+        with pytest.raises(ValueError):
+            artiruno.Engine.load(path)
+
+    with open(path, 'wb') as o:
+        o.write(b'not a checkpoint')
+    with pytest.raises(ValueError):
+        artiruno.Engine.load(path)
+
+def test_answer_store(tmp_path):
+    from artiruno.store import AnswerStore
+
+    criteria = [('x', 'y', 'z')] * 3
+    store = AnswerStore(str(tmp_path / 'answers.db'))
+    def asker(a, b):
+        return Relation.cmp(a[::-1], b[::-1])
+    prefs = vda(criteria, asker = asker, store = store)
+    (a, b, rel), *_ = store.triples(criteria)
+    assert rel == asker(a, b)
+    assert store.get(criteria, a, b) == rel
+    assert store.get(criteria, b, a) == -rel
+    assert store.get(criteria[1:], a[1:], b[1:]) is None
+
+    # With the same criteria, we can replay the session without
+    # asking anything.
+    store = AnswerStore(str(tmp_path / 'answers.db'))
+    assert vda(criteria, asker = asker_stub, store = store).relations == (
+        prefs.relations)
+
+    # Contradictory answers are skipped, and the rest still agree
+    # with the asker. Here, a stored answer says that `b` is better
+    # than `c`, which dominates `a`, so `a < b` can't be reversed.
+    a, b, c = ('x', 'z', 'x'), ('z', 'x', 'z'), ('z', 'z', 'y')
+    assert store.get(criteria, b, c) == GT and asker(a, b) == LT
+    store.put(criteria, a, b, GT)
+    prefs = vda(criteria, asker = asker, store = store)
+    assert prefs.cmp(a, b) == LT
+    assert all(rel in (IC, asker(a, b))
+        for (a, b), rel in prefs.relations.items())
+
 def test_one_criterion():
     '''When there's only one criterion, we should never need to ask
     questions, because the rule of dominance suffices to infer all